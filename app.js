@@ -16,6 +16,7 @@ var currentUser = null;
 var expandedMealGroups = {};
 var notifications = [];
 var unreadNotificationCount = 0;
+var notificationStream = null;
 var isCalorieExpanded = false;
 var weightChart = null;
 var selectedGoalType = null;
@@ -110,6 +111,7 @@ function showApp() {
     loadMealsForDate(currentDate);
     loadGoalStatus();
     loadNotifications();
+    connectNotificationStream();
 }
 
 function login() {
@@ -198,11 +200,13 @@ function register() {
 function logout() {
     fetch(apiUrl('api/logout'), { method: 'POST' })
         .then(function() {
+            disconnectNotificationStream();
             currentUser = null;
             showLogin();
         })
         .catch(function(error) {
             console.error('Logout failed:', error);
+            disconnectNotificationStream();
             currentUser = null;
             showLogin();
         });
@@ -639,6 +643,42 @@ function loadNotifications() {
         });
 }
 
+function connectNotificationStream() {
+    if (!currentUser || notificationStream || !window.EventSource) return;
+    
+    notificationStream = new EventSource(apiUrl('api/notifications/stream'));
+    
+    notificationStream.addEventListener('read', function(event) {
+        var data = JSON.parse(event.data);
+        notifications.forEach(function(notification) {
+            if (data.all || data.ids.indexOf(notification.id) !== -1) {
+                notification.is_read = true;
+            }
+        });
+        unreadNotificationCount = data.unread_count;
+        updateNotificationBadge();
+        renderNotifications();
+    });
+    
+    notificationStream.addEventListener('resync', function() {
+        loadNotifications();
+    });
+    
+    notificationStream.onerror = function() {
+        // The browser reconnects on its own unless the server refused the stream
+        if (notificationStream && notificationStream.readyState === EventSource.CLOSED) {
+            notificationStream = null;
+        }
+    };
+}
+
+function disconnectNotificationStream() {
+    if (notificationStream) {
+        notificationStream.close();
+        notificationStream = null;
+    }
+}
+
 function updateNotificationBadge() {
     var badge = document.getElementById('notification-badge');
     if (unreadNotificationCount > 0) {
@@ -680,7 +720,10 @@ function toggleNotifications() {
         dropdown.classList.remove('show');
     } else {
         dropdown.classList.add('show');
-        loadNotifications();
+        // With a live stream the list is already current
+        if (!notificationStream) {
+            loadNotifications();
+        }
     }
 }
 
@@ -694,7 +737,7 @@ function markNotificationRead(notificationId) {
             var notification = notifications.find(function(n) { return n.id === notificationId; });
             if (notification && !notification.is_read) {
                 notification.is_read = true;
-                unreadNotificationCount = Math.max(0, unreadNotificationCount - 1);
+                unreadNotificationCount = data.unread_count !== undefined ? data.unread_count : Math.max(0, unreadNotificationCount - 1);
                 updateNotificationBadge();
                 renderNotifications();
             }
@@ -1474,6 +1517,7 @@ function confirmSelection() {
         console.log('Server response data:', data);
         if (data.success) {
             console.log('✅ Meal saved successfully');
+            foodEntry.meal_id = data.meal_id;
         } else {
             console.error('❌ Failed to save meal:', data.error);
             alert('Failed to save meal: ' + (data.error || 'Unknown error'));
@@ -1517,6 +1561,7 @@ function loadMealsForDate(date) {
                     var baseFat = validateNutritionValue(meal.fat / (meal.quantity / 100), 0);
                     
                     return {
+                        meal_id: meal.id,
                         food_id: meal.food_id,
                         name: meal.food_name,
                         cal: baseCal,
@@ -1626,6 +1671,7 @@ function removeFood(uniqueId) {
         console.log('Food removed from local array');
         updateSelectedFoods();
         
+        var deleteUrl = 'delete_meal';
         var deleteData = {
             food_id: foodToRemove.food_id,
             meal_type: foodToRemove.meal,
@@ -1633,9 +1679,14 @@ function removeFood(uniqueId) {
             date_eaten: formatDate(currentDate)
         };
         
+        if (foodToRemove.meal_id) {
+            deleteUrl = 'api/meals/delete';
+            deleteData = { ids: [foodToRemove.meal_id] };
+        }
+        
         console.log('Sending delete request:', deleteData);
         
-        fetch(apiUrl('delete_meal'), {
+        fetch(apiUrl(deleteUrl), {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(deleteData)
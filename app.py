@@ -5,15 +5,37 @@ Complete Enhanced Food Search App - Backend
 Flask backend with all features combined
 """
 
-from flask import Flask, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, g, has_request_context, request, jsonify, session, redirect, url_for, stream_with_context
 import requests
 import json
 import sqlite3
 import os
 from datetime import datetime, date, timedelta
+import atexit
+import gzip
+import mimetypes
+import copy
 import hashlib
+import logging
 import math
-from functools import wraps
+import queue
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from bisect import bisect_left
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 __version__ = "2.2.4"
 
@@ -21,170 +43,1131 @@ app = Flask(__name__, static_folder='.', static_url_path='')
 app.secret_key = 'your-secret-key-change-this-in-production'
 DB_PATH = 'food_app.db'
 
+# SQLite connection pool and pragma settings
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 128 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+
+# Date-range meal API limits (longer ranges are streamed)
+MEAL_RANGE_MAX_DAYS = int(os.environ.get('MEAL_RANGE_MAX_DAYS', 366))
+MEAL_RANGE_STREAM_DAYS = int(os.environ.get('MEAL_RANGE_STREAM_DAYS', 31))
+
+# Maximum entries accepted by the batch meal logging endpoint
+MEAL_BATCH_MAX_ENTRIES = int(os.environ.get('MEAL_BATCH_MAX_ENTRIES', 200))
+
+# Per-user profile cache settings
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+# Upstream food API (kaloriabazis.hu) settings
+UPSTREAM_BASE_URL = 'https://kaloriabazis.hu/'
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+UPSTREAM_COOKIE_TTL = int(os.environ.get('UPSTREAM_COOKIE_TTL', 1800))
+
+# Upstream search result cache settings
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1024))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+SEARCH_CACHE_PERSIST = os.environ.get('SEARCH_CACHE_PERSIST', 'false').lower() == 'true'
+SEARCH_CACHE_PURGE_INTERVAL = int(os.environ.get('SEARCH_CACHE_PURGE_INTERVAL', 300))
+
+# Set by init_database() once the food_mdm full-text index is in place
+FOOD_FTS_ENABLED = False
+
+# Fuzzy (trigram) local search settings
+FUZZY_SEARCH_MIN_RESULTS = int(os.environ.get('FUZZY_SEARCH_MIN_RESULTS', 8))
+FUZZY_SEARCH_MIN_SIMILARITY = float(os.environ.get('FUZZY_SEARCH_MIN_SIMILARITY', 0.5))
+FUZZY_SEARCH_CANDIDATE_LIMIT = 1000
+
+# Search strategy: 'local_first', 'parallel' or 'upstream_only'
+SEARCH_STRATEGIES = ('local_first', 'parallel', 'upstream_only')
+SEARCH_STRATEGY = os.environ.get('SEARCH_STRATEGY', 'local_first')
+LOCAL_FIRST_MIN_RESULTS = int(os.environ.get('LOCAL_FIRST_MIN_RESULTS', 8))
+SEARCH_PARALLEL_DEADLINE = float(os.environ.get('SEARCH_PARALLEL_DEADLINE', 2.0))
+
+# Upstream deadline, hedging and circuit breaker settings
+UPSTREAM_DEADLINE = float(os.environ.get('UPSTREAM_DEADLINE', 4.0))
+UPSTREAM_HEDGE_DELAY = float(os.environ.get('UPSTREAM_HEDGE_DELAY', 1.0))
+UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', 5))
+UPSTREAM_BREAKER_RESET = float(os.environ.get('UPSTREAM_BREAKER_RESET', 30))
+
+# Background write-back of upstream search results into food_mdm
+MDM_WRITE_BEHIND = os.environ.get('MDM_WRITE_BEHIND', 'true').lower() == 'true'
+MDM_WRITE_BEHIND_BATCH = int(os.environ.get('MDM_WRITE_BEHIND_BATCH', 200))
+MDM_WRITE_BEHIND_INTERVAL = float(os.environ.get('MDM_WRITE_BEHIND_INTERVAL', 1.0))
+MDM_WRITE_BEHIND_QUEUE = int(os.environ.get('MDM_WRITE_BEHIND_QUEUE', 10000))
+
+# Logging: default level, per-module overrides ("search=DEBUG,db=WARNING") and payload dumps
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_PAYLOADS = os.environ.get('LOG_PAYLOADS', 'false').lower() == 'true'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# Request, SQLite and upstream metrics exposed on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Opt-in SQL profiler: per-request statement log, slow-statement threshold and summary headers
+SQL_PROFILE = os.environ.get('SQL_PROFILE', 'false').lower() == 'true'
+SQL_SLOW_MS = float(os.environ.get('SQL_SLOW_MS', 50))
+SQL_PROFILE_HEADER = os.environ.get('SQL_PROFILE_HEADER', 'false').lower() == 'true'
+
+# Server-sent notification stream: connections per worker, heartbeat and per-client buffer
+NOTIFICATION_STREAM_MAX = int(os.environ.get('NOTIFICATION_STREAM_MAX', 100))
+NOTIFICATION_HEARTBEAT = float(os.environ.get('NOTIFICATION_HEARTBEAT', 25))
+NOTIFICATION_STREAM_BUFFER = int(os.environ.get('NOTIFICATION_STREAM_BUFFER', 64))
+NOTIFICATION_PAGE_MAX = int(os.environ.get('NOTIFICATION_PAGE_MAX', 100))
+
+# Background fan-out of feature announcements: users per transaction and pause between chunks
+ANNOUNCEMENT_FANOUT_CHUNK = int(os.environ.get('ANNOUNCEMENT_FANOUT_CHUNK', 1000))
+ANNOUNCEMENT_FANOUT_PAUSE = float(os.environ.get('ANNOUNCEMENT_FANOUT_PAUSE', 0.05))
+
+# Frontend assets served from memory; fingerprinted URLs are cached for ASSET_MAX_AGE
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE', 31536000))
+ASSET_RELOAD = os.environ.get('ASSET_RELOAD', 'false').lower() == 'true'
+# Output of `flask build-assets`; served instead of the sources when its manifest exists
+ASSET_BUNDLE_DIR = os.environ.get('ASSET_BUNDLE_DIR', os.path.join(ASSET_DIR, 'bundle'))
+
 # ========================
-# DATABASE INITIALIZATION
+# LOGGING
 # ========================
 
-def init_database():
-    """Initialize SQLite database with all features"""
-    try:
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                first_name TEXT,
-                last_name TEXT,
-                height REAL,
-                weight REAL,
-                age INTEGER,
-                activity_level TEXT DEFAULT 'moderate',
-                daily_calorie_goal INTEGER DEFAULT 2000,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Check existing columns and add new ones
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        migrations_applied = []
-        
-        # Add macro columns if missing
-        if 'macro_preset' not in columns:
-            cursor.execute('ALTER TABLE users ADD COLUMN macro_preset TEXT DEFAULT "balanced"')
-            cursor.execute('ALTER TABLE users ADD COLUMN carbs_percent INTEGER DEFAULT 40')
-            cursor.execute('ALTER TABLE users ADD COLUMN protein_percent INTEGER DEFAULT 30')
-            cursor.execute('ALTER TABLE users ADD COLUMN fat_percent INTEGER DEFAULT 30')
-            migrations_applied.append('macro_tracking')
-        
-        # Add goal tracking columns
-        if 'goal_type' not in columns:
-            cursor.execute('ALTER TABLE users ADD COLUMN goal_type TEXT DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN target_weight REAL DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN target_date DATE DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN goal_created_date DATE DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN calculated_daily_calories INTEGER DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN bmr REAL DEFAULT NULL')
-            cursor.execute('ALTER TABLE users ADD COLUMN tdee REAL DEFAULT NULL')
-            migrations_applied.append('goal_tracking')
-        
-        # Weight logs table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS weight_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                weight REAL NOT NULL,
-                log_date DATE NOT NULL,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(user_id, log_date)
-            )
-        ''')
-        
-        # Notifications table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT NOT NULL,
-                message TEXT NOT NULL,
-                type TEXT DEFAULT 'info',
-                is_read BOOLEAN DEFAULT 0,
-                action_url TEXT DEFAULT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+LOGGER_NAME = 'foodapp'
+
+class JsonFormatter(logging.Formatter):
+    """Render a log record as one JSON object per line.
+    
+    Anything passed through ``extra=`` becomes a top-level field.
+    """
+    
+    RESERVED = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+    
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that formats on the caller and drops records when the queue is full.
+    
+    Request threads never wait on the writer thread or on stdout.
+    """
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = self.format(record)
+        record.message = record.msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging():
+    """Attach the queue-backed JSON handler and apply the configured levels; returns the listener"""
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    root.propagate = False
+    
+    for override in filter(None, (part.strip() for part in LOG_LEVELS.split(','))):
+        name, _, level = override.partition('=')
+        name = name.strip()
+        if not name.startswith(LOGGER_NAME):
+            name = f"{LOGGER_NAME}.{name}"
+        logging.getLogger(name).setLevel(getattr(logging, level.strip().upper(), logging.INFO))
+    
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.setFormatter(JsonFormatter())
+    root.handlers = [queue_handler]
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = configure_logging()
+logger = logging.getLogger(LOGGER_NAME)
+db_logger = logging.getLogger(f'{LOGGER_NAME}.db')
+auth_logger = logging.getLogger(f'{LOGGER_NAME}.auth')
+meal_logger = logging.getLogger(f'{LOGGER_NAME}.meals')
+search_logger = logging.getLogger(f'{LOGGER_NAME}.search')
+upstream_logger = logging.getLogger(f'{LOGGER_NAME}.upstream')
+sql_logger = logging.getLogger(f'{LOGGER_NAME}.sql')
+
+if SEARCH_STRATEGY not in SEARCH_STRATEGIES:
+    logger.warning("Unknown SEARCH_STRATEGY, using local_first", extra={'strategy': SEARCH_STRATEGY})
+    SEARCH_STRATEGY = 'local_first'
+
+# ========================
+# METRICS
+# ========================
+
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5)
+UPSTREAM_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0)
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text format
+    
+    Labels are passed as tuples of ``(name, value)`` pairs in a fixed order so
+    recording a sample is a dict lookup and a bisect under one lock.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+    
+    def counter(self, name, help_text):
+        self._help[name] = help_text
+        self._counters[name] = {}
+    
+    def histogram(self, name, help_text, buckets):
+        self._help[name] = help_text
+        self._histograms[name] = (buckets, {})
+    
+    def inc(self, name, labels=(), amount=1):
+        series = self._counters[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + amount
+    
+    def observe(self, name, value, labels=()):
+        buckets, series = self._histograms[name]
+        index = bisect_left(buckets, value)
+        with self._lock:
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            
+            for name, (buckets, series) in self._histograms.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, counts in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {counts[-1]:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+def format_labels(labels):
+    """Render label pairs as {a="1",b="2"} with Prometheus escaping"""
+    if not labels:
+        return ''
+    rendered = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        rendered.append(f'{key}="{value}"')
+    return '{' + ','.join(rendered) + '}'
+
+def render_gauges(prefix, values, lines):
+    """Append numeric diagnostics as untyped samples; strings become *_info{value=...} 1"""
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            render_gauges(name, value, lines)
+        elif isinstance(value, bool):
+            lines.append(f"# TYPE {name} untyped")
+            lines.append(f"{name} {int(value)}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"# TYPE {name} untyped")
+            lines.append(f"{name} {value}")
+        elif isinstance(value, str):
+            lines.append(f"# TYPE {name}_info untyped")
+            lines.append(f"{name}_info{format_labels((('value', value),))} 1")
+
+metrics = MetricsRegistry()
+metrics.counter('foodapp_http_requests_total', 'HTTP requests by route, method and status')
+metrics.histogram('foodapp_http_request_duration_seconds', 'HTTP request latency by route and method', HTTP_LATENCY_BUCKETS)
+metrics.histogram('foodapp_sqlite_query_duration_seconds', 'SQLite statement latency by statement type', SQL_LATENCY_BUCKETS)
+metrics.histogram('foodapp_upstream_request_duration_seconds', 'kaloriabazis.hu call latency by call and outcome', UPSTREAM_LATENCY_BUCKETS)
+
+# ========================
+# DATABASE CONNECTIONS
+# ========================
+
+def statement_type(sql):
+    """First keyword of a SQL statement (SELECT, INSERT, ...) for metric labels"""
+    words = sql.split(None, 1)
+    return words[0].upper() if words else 'EMPTY'
+
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+SQL_PLANNABLE = frozenset({'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'})
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse whitespace and replace inline literals so equivalent statements group together"""
+    sql = SQL_STRING_LITERAL.sub('?', sql)
+    sql = SQL_NUMBER_LITERAL.sub('?', sql)
+    return ' '.join(sql.split())
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records each statement's latency in the SQLite histogram
+    
+    sqlite3 runs a query lazily: execute() only takes the first step and the
+    rest of the work happens while rows are fetched. Fetch time is therefore
+    added to the statement, which is recorded once its rows are exhausted,
+    the cursor runs another statement, or the cursor is closed or collected.
+    """
+    
+    _pending = None
+    
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, parameters, time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._begin(sql, None, time.perf_counter() - started)
+    
+    def _begin(self, sql, parameters, elapsed):
+        self._pending = [sql, parameters, elapsed]
+        if self.description is None:
+            # No result rows to stream (writes, failed statements)
+            self._finish()
+    
+    def _fetched(self, started, rows, exhausted):
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+            if exhausted:
+                self._finish()
+    
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self._record(*pending)
+    
+    def _record(self, sql, parameters, elapsed):
+        if METRICS_ENABLED:
+            metrics.observe('foodapp_sqlite_query_duration_seconds', elapsed, (('statement', statement_type(sql)),))
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, 0 if row is None else 1, row is None)
+        return row
+    
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+    
+    def close(self):
+        self._finish()
+        super().close()
+    
+    def __del__(self):
+        self._finish()
+
+class ProfilingCursor(TimedCursor):
+    """Timed cursor that also keeps a per-request statement log and reports slow statements
+    
+    Rows are the rows fetched for queries and ``rowcount`` for writes. An
+    entry is logged when the statement starts and its time is final once the
+    statement is recorded. Slow statements are logged with their EXPLAIN
+    QUERY PLAN (not for executemany).
+    """
+    
+    _entry = None
+    
+    def _begin(self, sql, parameters, elapsed):
+        entry = {'sql': normalize_sql(sql), 'ms': round(elapsed * 1000, 3), 'rows': max(self.rowcount, 0)}
+        self._entry = entry
+        if has_request_context():
+            g.setdefault('sql_profile', []).append(entry)
+        super()._begin(sql, parameters, elapsed)
+    
+    def _fetched(self, started, rows, exhausted):
+        if self._entry is not None:
+            self._entry['rows'] += rows
+        super()._fetched(started, rows, exhausted)
+    
+    def _record(self, sql, parameters, elapsed):
+        super()._record(sql, parameters, elapsed)
+        entry = self._entry
+        entry['ms'] = round(elapsed * 1000, 3)
+        if entry['ms'] >= SQL_SLOW_MS:
+            self._log_slow(sql, parameters, entry)
+    
+    def _log_slow(self, sql, parameters, entry):
+        fields = dict(entry)
+        if parameters is not None and statement_type(sql) in SQL_PLANNABLE:
+            try:
+                # A plain cursor so the plan lookup is not itself profiled
+                plan = sqlite3.Cursor(self.connection).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+                fields['plan'] = [row[-1] for row in plan]
+            except sqlite3.Error as e:
+                fields['plan_error'] = str(e)
+        sql_logger.warning("Slow SQL statement", extra=fields)
+
+def summarize_sql_profile(entries):
+    """Aggregate a request's statement log into count, total time and the costliest statements"""
+    by_statement = {}
+    for entry in entries:
+        stats = by_statement.setdefault(entry['sql'], {'sql': entry['sql'], 'calls': 0, 'ms': 0.0, 'rows': 0})
+        stats['calls'] += 1
+        stats['ms'] += entry['ms']
+        stats['rows'] += entry['rows']
+    top = sorted(by_statement.values(), key=lambda stats: stats['ms'], reverse=True)
+    return {
+        'count': len(entries),
+        'total_ms': round(sum(entry['ms'] for entry in entries), 3),
+        'top': top[:5]
+    }
+
+DB_CURSOR_CLASS = ProfilingCursor if SQL_PROFILE else TimedCursor
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit one behind execute(), are timed"""
+    
+    def cursor(self, factory=None):
+        return super().cursor(factory or DB_CURSOR_CLASS)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def open_db_connection():
+    """Open a SQLite connection in WAL mode with the tuned pragmas"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        check_same_thread=False,
+        factory=TimedConnection if METRICS_ENABLED or SQL_PROFILE else sqlite3.Connection
+    )
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections handed out through a context manager
+
+    A thread borrows one connection for the whole ``with`` block; nested
+    blocks on the same thread reuse it. Any transaction left open when the
+    outermost block exits is rolled back, matching what ``close()`` used to do.
+    """
+
+    def __init__(self, max_idle):
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._local = threading.local()
+        self.opened = 0
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
         
-        # Food MDM table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS food_mdm (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                food_id TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                cal REAL,
-                protein REAL,
-                carbo REAL,
-                fat REAL,
-                piece TEXT,
-                portions TEXT,
-                api_response TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = open_db_connection()
+            self.opened += 1
         
-        # Meal log table
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def stats(self):
+        return {'opened': self.opened, 'idle': self._idle.qsize(), 'max_idle': self._idle.maxsize}
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
+def get_db():
+    """Borrow a pooled SQLite connection for the duration of a with block"""
+    return db_pool.connection()
+
+# ========================
+# CACHING
+# ========================
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# ========================
+# DATABASE INITIALIZATION
+# ========================
+
+def init_food_fts(cursor):
+    """Create the FTS5 index over food_mdm names, its sync triggers, and backfill it if new"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'food_mdm_fts'")
+    exists = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS food_mdm_fts USING fts5(
+            name,
+            content='food_mdm',
+            content_rowid='id',
+            prefix='2 3'
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS food_mdm_fts_insert AFTER INSERT ON food_mdm BEGIN
+            INSERT INTO food_mdm_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS food_mdm_fts_delete AFTER DELETE ON food_mdm BEGIN
+            INSERT INTO food_mdm_fts (food_mdm_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS food_mdm_fts_update AFTER UPDATE OF name ON food_mdm BEGIN
+            INSERT INTO food_mdm_fts (food_mdm_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO food_mdm_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    
+    if not exists:
+        cursor.execute("INSERT INTO food_mdm_fts (food_mdm_fts) VALUES ('rebuild')")
+        db_logger.info("Built food_mdm full-text index")
+
+def rebuild_daily_nutrition(cursor, user_id=None):
+    """Recompute daily_nutrition rows from meal_log (for one user, or everyone)"""
+    user_filter = 'WHERE user_id = ?' if user_id is not None else ''
+    params = (user_id,) if user_id is not None else ()
+    
+    cursor.execute(f'DELETE FROM daily_nutrition {user_filter}', params)
+    cursor.execute(f'''
+        INSERT INTO daily_nutrition
+            (user_id, date_eaten, meal_type, calories, protein, carbohydrates, fat, item_count)
+        SELECT user_id, date_eaten, meal_type,
+               TOTAL(calories), TOTAL(protein), TOTAL(carbohydrates), TOTAL(fat), COUNT(*)
+        FROM meal_log
+        {user_filter}
+        GROUP BY user_id, date_eaten, meal_type
+    ''', params)
+    return cursor.rowcount
+
+def init_daily_nutrition(cursor):
+    """Create the per-day nutrition rollup and the meal_log triggers that maintain it"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_nutrition'")
+    exists = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_nutrition (
+            user_id INTEGER NOT NULL,
+            date_eaten DATE NOT NULL,
+            meal_type TEXT NOT NULL,
+            calories REAL NOT NULL DEFAULT 0,
+            protein REAL NOT NULL DEFAULT 0,
+            carbohydrates REAL NOT NULL DEFAULT 0,
+            fat REAL NOT NULL DEFAULT 0,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date_eaten, meal_type)
+        ) WITHOUT ROWID
+    ''')
+    
+    # The triggers run inside the statement that changes meal_log, so the
+    # rollup always commits or rolls back together with the meal rows
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meal_log_nutrition_insert AFTER INSERT ON meal_log BEGIN
+            INSERT INTO daily_nutrition
+                (user_id, date_eaten, meal_type, calories, protein, carbohydrates, fat, item_count)
+            VALUES (new.user_id, new.date_eaten, new.meal_type,
+                    IFNULL(new.calories, 0), IFNULL(new.protein, 0), IFNULL(new.carbohydrates, 0), IFNULL(new.fat, 0), 1)
+            ON CONFLICT (user_id, date_eaten, meal_type) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbohydrates = carbohydrates + excluded.carbohydrates,
+                fat = fat + excluded.fat,
+                item_count = item_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meal_log_nutrition_delete AFTER DELETE ON meal_log BEGIN
+            UPDATE daily_nutrition SET
+                calories = calories - IFNULL(old.calories, 0),
+                protein = protein - IFNULL(old.protein, 0),
+                carbohydrates = carbohydrates - IFNULL(old.carbohydrates, 0),
+                fat = fat - IFNULL(old.fat, 0),
+                item_count = item_count - 1
+            WHERE user_id = old.user_id AND date_eaten = old.date_eaten AND meal_type = old.meal_type;
+            DELETE FROM daily_nutrition
+            WHERE user_id = old.user_id AND date_eaten = old.date_eaten AND meal_type = old.meal_type
+              AND item_count <= 0;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meal_log_nutrition_update
+        AFTER UPDATE OF user_id, date_eaten, meal_type, calories, protein, carbohydrates, fat ON meal_log BEGIN
+            UPDATE daily_nutrition SET
+                calories = calories - IFNULL(old.calories, 0),
+                protein = protein - IFNULL(old.protein, 0),
+                carbohydrates = carbohydrates - IFNULL(old.carbohydrates, 0),
+                fat = fat - IFNULL(old.fat, 0),
+                item_count = item_count - 1
+            WHERE user_id = old.user_id AND date_eaten = old.date_eaten AND meal_type = old.meal_type;
+            DELETE FROM daily_nutrition
+            WHERE user_id = old.user_id AND date_eaten = old.date_eaten AND meal_type = old.meal_type
+              AND item_count <= 0;
+            INSERT INTO daily_nutrition
+                (user_id, date_eaten, meal_type, calories, protein, carbohydrates, fat, item_count)
+            VALUES (new.user_id, new.date_eaten, new.meal_type,
+                    IFNULL(new.calories, 0), IFNULL(new.protein, 0), IFNULL(new.carbohydrates, 0), IFNULL(new.fat, 0), 1)
+            ON CONFLICT (user_id, date_eaten, meal_type) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbohydrates = carbohydrates + excluded.carbohydrates,
+                fat = fat + excluded.fat,
+                item_count = item_count + 1;
+        END
+    ''')
+    
+    if not exists:
+        rows = rebuild_daily_nutrition(cursor)
+        db_logger.info("Built daily nutrition rollup", extra={'rows': rows})
+
+# PRAGMA user_version stamped by init_database; bump it when a migration needs to run once
+#   1: notification_unread triggers skip NULL user_id
+DB_SCHEMA_VERSION = 1
+
+def init_notification_unread(cursor, schema_version):
+    """Create the per-user unread notification counter and its triggers, and backfill it if new"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notification_unread'")
+    exists = cursor.fetchone() is not None
+    
+    # Triggers from before version 1 could add counters under an automatic rowid
+    # for NULL user ids; replace them and rebuild the counters once
+    rebuild = not exists or schema_version < 1
+    if rebuild:
+        for name in ('notifications_unread_insert', 'notifications_unread_delete', 'notifications_unread_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_unread (
+            user_id INTEGER PRIMARY KEY,
+            unread_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notifications_unread_insert
+        AFTER INSERT ON notifications WHEN NEW.is_read = 0 AND NEW.user_id IS NOT NULL BEGIN
+            INSERT INTO notification_unread (user_id, unread_count) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET unread_count = unread_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notifications_unread_delete
+        AFTER DELETE ON notifications WHEN OLD.is_read = 0 AND OLD.user_id IS NOT NULL BEGIN
+            UPDATE notification_unread SET unread_count = unread_count - 1 WHERE user_id = OLD.user_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notifications_unread_update
+        AFTER UPDATE OF is_read, user_id ON notifications
+        WHEN (OLD.is_read = 0) != (NEW.is_read = 0) OR OLD.user_id IS NOT NEW.user_id BEGIN
+            UPDATE notification_unread SET unread_count = unread_count - 1
+            WHERE user_id = OLD.user_id AND OLD.is_read = 0;
+            INSERT INTO notification_unread (user_id, unread_count)
+            SELECT NEW.user_id, 1 WHERE NEW.is_read = 0 AND NEW.user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET unread_count = unread_count + 1;
+        END
+    ''')
+    
+    if rebuild:
+        cursor.execute('DELETE FROM notification_unread')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS meal_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                food_id TEXT NOT NULL,
-                food_name TEXT NOT NULL,
-                meal_type TEXT NOT NULL,
-                quantity REAL NOT NULL,
-                calories REAL,
-                protein REAL,
-                carbohydrates REAL,
-                fat REAL,
-                logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                date_eaten DATE,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
+            INSERT INTO notification_unread (user_id, unread_count)
+            SELECT user_id, COUNT(*) FROM notifications
+            WHERE is_read = 0 AND user_id IS NOT NULL
+            GROUP BY user_id
         ''')
-        
-        # Create indexes
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_weight_logs_user_date ON weight_logs (user_id, log_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_food_mdm_name ON food_mdm (name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_food_mdm_food_id ON food_mdm (food_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_log_date ON meal_log (date_eaten)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_log_user ON meal_log (user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id)')
-        
-        # Add notifications for new features
-        if migrations_applied:
+        db_logger.info("Built notification unread counters", extra={'users': cursor.rowcount})
+
+def enqueue_announcement(cursor, key, title, message, notification_type='feature', action_url=None):
+    """Record a one-off announcement for every current user; the fan-out runs in the background
+    
+    Users are captured by id range (up to the current MAX(id)), so this is
+    O(1) at startup and the key makes it idempotent across restarts.
+    """
+    cursor.execute('''
+        INSERT OR IGNORE INTO announcement_jobs (key, title, message, type, action_url, max_user_id)
+        SELECT ?, ?, ?, ?, ?, COALESCE(MAX(id), 0) FROM users
+    ''', (key, title, message, notification_type, action_url))
+    return cursor.rowcount > 0
+
+# Indexes owned by init_database(); anything in RETIRED_INDEXES is dropped on startup
+MANAGED_INDEXES = {
+    'idx_food_mdm_name': 'food_mdm (name)',
+    'idx_food_mdm_trigrams_food': 'food_mdm_trigrams (food_mdm_id)',
+    # Ordering only: the meal queries read most of the row, so a covering index would copy the table
+    'idx_meal_log_user_date_logged': 'meal_log (user_id, date_eaten, logged_at)',
+    'idx_search_cache_expires': 'search_cache (expires_at)',
+    'idx_notifications_user_created': 'notifications (user_id, created_at)',
+    'idx_notifications_user_read_created': 'notifications (user_id, is_read, created_at)',
+}
+RETIRED_INDEXES = [
+    'idx_meal_log_date',     # covered by idx_meal_log_user_date_logged
+    'idx_meal_log_user',     # prefix of idx_meal_log_user_date_logged
+    'idx_food_mdm_food_id',  # duplicates the UNIQUE(food_id) autoindex
+    'idx_weight_logs_user_date',  # duplicates the UNIQUE(user_id, log_date) autoindex
+    'idx_notifications_user',  # prefix of idx_notifications_user_created
+]
+
+# Statements run by the routes and explained by check_query_plans
+MEAL_LOG_FOR_DATE = '''
+    SELECT id, food_id, food_name, meal_type, quantity, calories, protein, carbohydrates, fat, logged_at
+    FROM meal_log WHERE user_id = ? AND date_eaten = ? ORDER BY logged_at DESC
+'''
+MEAL_LOG_RANGE = '''
+    SELECT id, date_eaten, food_id, food_name, meal_type, quantity,
+           calories, protein, carbohydrates, fat, logged_at
+    FROM meal_log WHERE user_id = ? AND date_eaten BETWEEN ? AND ?
+    ORDER BY date_eaten, logged_at DESC
+'''
+MEAL_LOG_DELETE_ONE = '''
+    DELETE FROM meal_log
+    WHERE id = (
+        SELECT id FROM meal_log
+        WHERE user_id = ? AND food_id = ? AND meal_type = ? AND quantity = ? AND date_eaten = ?
+        LIMIT 1
+    )
+'''
+DAILY_NUTRITION_RANGE = '''
+    SELECT meal_type, SUM(calories), SUM(protein), SUM(carbohydrates), SUM(fat), SUM(item_count)
+    FROM daily_nutrition WHERE user_id = ? AND date_eaten BETWEEN ? AND ?
+    GROUP BY meal_type
+'''
+WEIGHT_HISTORY = '''
+    SELECT weight, log_date, notes FROM weight_logs
+    WHERE user_id = ? AND log_date >= ? ORDER BY log_date ASC
+'''
+
+# One page of a user's notifications, newest first
+NOTIFICATIONS_PAGE = '''
+    SELECT id, title, message, type, is_read, created_at FROM notifications
+    WHERE user_id = ? {filters}
+    ORDER BY created_at DESC, id DESC LIMIT ?
+'''
+NOTIFICATIONS_UNREAD_FILTER = 'AND is_read = 0'
+# Keyset pagination: rows strictly older than the cursor notification
+NOTIFICATIONS_BEFORE_FILTER = '''AND (created_at, id) < (
+        SELECT created_at, id FROM notifications WHERE id = ? AND user_id = ?
+    )'''
+
+HOT_QUERIES = {
+    'get_meals_for_date': (MEAL_LOG_FOR_DATE, (0, '2000-01-01')),
+    'get_meals_range': (MEAL_LOG_RANGE, (0, '2000-01-01', '2000-01-31')),
+    'delete_meal': (MEAL_LOG_DELETE_ONE, (0, '', '', 0.0, '2000-01-01')),
+    'daily_nutrition': (DAILY_NUTRITION_RANGE, (0, '2000-01-01', '2000-01-31')),
+    'weight_history': (WEIGHT_HISTORY, (0, '2000-01-01')),
+    'notifications': (
+        NOTIFICATIONS_PAGE.format(filters=NOTIFICATIONS_BEFORE_FILTER),
+        (0, 0, 0, 10)
+    ),
+    'notifications_unread': (
+        NOTIFICATIONS_PAGE.format(filters=f'{NOTIFICATIONS_UNREAD_FILTER} {NOTIFICATIONS_BEFORE_FILTER}'),
+        (0, 0, 0, 10)
+    ),
+}
+
+def sync_indexes(cursor):
+    """Create the managed indexes and drop retired ones"""
+    for name in RETIRED_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, definition in MANAGED_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+def check_query_plans(cursor):
+    """Run EXPLAIN QUERY PLAN on the hot queries and warn about full scans and full sorts"""
+    warnings = []
+    for name, (query, params) in HOT_QUERIES.items():
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        for row in cursor.fetchall():
+            detail = row[-1]
+            full_scan = detail.startswith('SCAN ') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail
+            # Sorting only the rows of one index prefix ("RIGHT PART OF ORDER BY") is cheap
+            full_sort = detail == 'USE TEMP B-TREE FOR ORDER BY'
+            if full_scan or full_sort:
+                warnings.append(f'{name}: {detail}')
+    
+    for warning in warnings:
+        db_logger.warning("Query plan check", extra={'plan': warning})
+    return warnings
+
+USER_PROFILE_COLUMNS = ['id', 'username', 'email', 'first_name', 'last_name', 'height', 'weight', 'age', 'activity_level', 'daily_calorie_goal']
+USER_MACRO_DEFAULTS = {'macro_preset': 'balanced', 'carbs_percent': 40, 'protein_percent': 30, 'fat_percent': 30}
+USER_UPDATABLE_COLUMNS = ['first_name', 'last_name', 'height', 'weight', 'age', 'activity_level', 'daily_calorie_goal']
+
+def build_user_schema(columns):
+    """Build the users column map and the statement text the auth/profile routes run"""
+    macro_columns = [col for col in USER_MACRO_DEFAULTS if col in columns]
+    profile_columns = USER_PROFILE_COLUMNS + macro_columns
+    update_columns = USER_UPDATABLE_COLUMNS + macro_columns
+    update_fields = [f'{col} = ?' for col in update_columns] + ['updated_at = CURRENT_TIMESTAMP']
+    
+    return {
+        'columns': set(columns),
+        'profile_columns': profile_columns,
+        'update_columns': update_columns,
+        'select_by_id': f"SELECT {', '.join(profile_columns)} FROM users WHERE id = ?",
+        'select_login': f"SELECT password_hash, {', '.join(profile_columns)} FROM users WHERE email = ?",
+        'update_profile': f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
+    }
+
+# Filled from PRAGMA table_info(users) by init_database(); the base columns always exist
+user_schema = build_user_schema(USER_PROFILE_COLUMNS)
+
+def refresh_user_schema(cursor):
+    """Probe the users table and replace the cached schema (run after migrations)"""
+    global user_schema
+    cursor.execute("PRAGMA table_info(users)")
+    user_schema = build_user_schema([column[1] for column in cursor.fetchall()])
+
+def user_row_to_dict(row):
+    """Map a row selected with user_schema['profile_columns'] to the API user dict"""
+    user = dict(USER_MACRO_DEFAULTS)
+    user.update(zip(user_schema['profile_columns'], row))
+    return user
+
+def init_database():
+    """Initialize SQLite database with all features"""
+    global FOOD_FTS_ENABLED
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    first_name TEXT,
+                    last_name TEXT,
+                    height REAL,
+                    weight REAL,
+                    age INTEGER,
+                    activity_level TEXT DEFAULT 'moderate',
+                    daily_calorie_goal INTEGER DEFAULT 2000,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Check existing columns and add new ones
+            cursor.execute("PRAGMA table_info(users)")
+            columns = [column[1] for column in cursor.fetchall()]
+            
+            migrations_applied = []
+            
+            # Add macro columns if missing
+            if 'macro_preset' not in columns:
+                cursor.execute('ALTER TABLE users ADD COLUMN macro_preset TEXT DEFAULT "balanced"')
+                cursor.execute('ALTER TABLE users ADD COLUMN carbs_percent INTEGER DEFAULT 40')
+                cursor.execute('ALTER TABLE users ADD COLUMN protein_percent INTEGER DEFAULT 30')
+                cursor.execute('ALTER TABLE users ADD COLUMN fat_percent INTEGER DEFAULT 30')
+                migrations_applied.append('macro_tracking')
+            
+            # Add goal tracking columns
+            if 'goal_type' not in columns:
+                cursor.execute('ALTER TABLE users ADD COLUMN goal_type TEXT DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN target_weight REAL DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN target_date DATE DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN goal_created_date DATE DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN calculated_daily_calories INTEGER DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN bmr REAL DEFAULT NULL')
+                cursor.execute('ALTER TABLE users ADD COLUMN tdee REAL DEFAULT NULL')
+                migrations_applied.append('goal_tracking')
+            
+            # Weight logs table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS weight_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    weight REAL NOT NULL,
+                    log_date DATE NOT NULL,
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    UNIQUE(user_id, log_date)
+                )
+            ''')
+            
+            # Notifications table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    title TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    type TEXT DEFAULT 'info',
+                    is_read BOOLEAN DEFAULT 0,
+                    action_url TEXT DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Unread notification counter maintained by notifications triggers
+            cursor.execute('PRAGMA user_version')
+            schema_version = cursor.fetchone()[0]
+            init_notification_unread(cursor, schema_version)
+            
+            # Announcements fanned out to notifications in chunks, with progress
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS announcement_jobs (
+                    key TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    type TEXT DEFAULT 'feature',
+                    action_url TEXT DEFAULT NULL,
+                    max_user_id INTEGER NOT NULL,
+                    last_user_id INTEGER NOT NULL DEFAULT 0,
+                    delivered INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP DEFAULT NULL
+                )
+            ''')
+            
+            # Food MDM table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS food_mdm (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    food_id TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    cal REAL,
+                    protein REAL,
+                    carbo REAL,
+                    fat REAL,
+                    piece TEXT,
+                    portions TEXT,
+                    api_response TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Meal log table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS meal_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    food_id TEXT NOT NULL,
+                    food_name TEXT NOT NULL,
+                    meal_type TEXT NOT NULL,
+                    quantity REAL NOT NULL,
+                    calories REAL,
+                    protein REAL,
+                    carbohydrates REAL,
+                    fat REAL,
+                    logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    date_eaten DATE,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Normalized food names and their trigram index for fuzzy search
+            cursor.execute("PRAGMA table_info(food_mdm)")
+            food_columns = [column[1] for column in cursor.fetchall()]
+            if 'name_normalized' not in food_columns:
+                cursor.execute('ALTER TABLE food_mdm ADD COLUMN name_normalized TEXT')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS food_mdm_trigrams (
+                    trigram TEXT NOT NULL,
+                    food_mdm_id INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, food_mdm_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            cursor.execute('SELECT id, name FROM food_mdm WHERE name_normalized IS NULL')
+            unindexed_foods = cursor.fetchall()
+            if unindexed_foods:
+                index_food_trigrams(cursor, unindexed_foods, replace=False)
+                db_logger.info("Built trigram index", extra={'foods': len(unindexed_foods)})
+            
+            # Per-day nutrition rollup maintained by meal_log triggers
+            init_daily_nutrition(cursor)
+            
+            # Upstream search cache table (shared by all worker processes when enabled)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    query TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    results TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (query, page)
+                )
+            ''')
+            
+            # Indexes
+            sync_indexes(cursor)
+            
+            # Full-text index for local food search (falls back to LIKE without FTS5)
+            try:
+                init_food_fts(cursor)
+                FOOD_FTS_ENABLED = True
+            except sqlite3.OperationalError as e:
+                db_logger.warning("FTS5 unavailable, local food search will use LIKE", extra={'error': str(e)})
+                FOOD_FTS_ENABLED = False
+            
+            # Announce new features (delivered by announcement_fanout after startup)
             if 'goal_tracking' in migrations_applied:
-                cursor.execute('''
-                    INSERT INTO notifications (user_id, title, message, type, action_url)
-                    SELECT id, 
-                           '🎯 New Feature: Goal Setting & Weight Tracking!',
-                           'Set weight goals, track daily progress, and get personalized calorie targets based on scientific calculations. Click to set your goals!',
-                           'feature',
-                           'goals'
-                    FROM users
-                    WHERE id NOT IN (SELECT DISTINCT user_id FROM notifications WHERE title LIKE '%Goal Setting%')
-                ''')
+                enqueue_announcement(
+                    cursor,
+                    'goal_tracking',
+                    '🎯 New Feature: Goal Setting & Weight Tracking!',
+                    'Set weight goals, track daily progress, and get personalized calorie targets based on scientific calculations. Click to set your goals!',
+                    action_url='goals'
+                )
             
             if 'macro_tracking' in migrations_applied:
-                cursor.execute('''
-                    INSERT INTO notifications (user_id, title, message, type)
-                    SELECT id, 
-                           'New Feature: Macro Tracking! 🎯',
-                           'We''ve added macro tracking to help you reach your nutrition goals! You can now set custom macro targets (carbs, protein, fat) in your settings. We''ve set you up with a balanced preset to start.',
-                           'feature'
-                    FROM users
-                    WHERE id NOT IN (SELECT DISTINCT user_id FROM notifications WHERE title LIKE '%Macro Tracking%')
-                ''')
-        
-        conn.commit()
-        print(f"✅ Database initialized successfully with {len(migrations_applied)} new features")
-        if migrations_applied:
-            print(f"   Applied migrations: {', '.join(migrations_applied)}")
-        return True
+                enqueue_announcement(
+                    cursor,
+                    'macro_tracking',
+                    'New Feature: Macro Tracking! 🎯',
+                    "We've added macro tracking to help you reach your nutrition goals! You can now set custom macro targets (carbs, protein, fat) in your settings. We've set you up with a balanced preset to start."
+                )
+            
+            cursor.execute(f'PRAGMA user_version = {DB_SCHEMA_VERSION}')
+            conn.commit()
+            refresh_user_schema(cursor)
+            check_query_plans(cursor)
+            db_logger.info("Database initialized", extra={'migrations': migrations_applied})
+            return True
         
     except Exception as e:
-        print(f"❌ Database initialization error: {e}")
+        db_logger.exception("Database initialization error")
         return False
-    finally:
-        conn.close()
 
 # ========================
 # SCIENTIFIC CALCULATIONS
@@ -238,311 +1221,1566 @@ def calculate_daily_calories_for_goal(current_weight, target_weight, target_date
     target_daily_calories = tdee + daily_calorie_change
     target_daily_calories = max(1200, min(4000, target_daily_calories))
     
-    return round(target_daily_calories)
+    return round(target_daily_calories)
+
+# ========================
+# AUTHENTICATION FUNCTIONS
+# ========================
+
+def hash_password(password):
+    """Simple password hashing using SHA-256 with salt"""
+    salt = "food_app_salt_2024"
+    return hashlib.sha256((password + salt).encode()).hexdigest()
+
+def verify_password(password, hashed):
+    """Verify password against hash"""
+    return hash_password(password) == hashed
+
+user_profile_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def cache_user_profile(cursor, user_id):
+    """Read a user's profile row and write it through to the profile cache"""
+    cursor.execute(user_schema['select_by_id'], (user_id,))
+    user_data = cursor.fetchone()
+    if not user_data:
+        user_profile_cache.invalidate(user_id)
+        return None
+    
+    user = user_row_to_dict(user_data)
+    user_profile_cache.set(user_id, user)
+    return user
+
+def require_auth(f):
+    """Decorator to require authentication for protected routes"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+# ========================
+# FOOD DATA PROCESSING
+# ========================
+
+def clean_api_response(api_food):
+    """Clean and normalize API response data for consistent storage"""
+    def safe_float(value):
+        if not value:
+            return 0.0
+        try:
+            str_val = str(value).strip()
+            str_val = str_val.replace('kcal', '').replace('cal', '').replace('g', '').strip()
+            if not str_val or str_val.lower() in ['n/a', 'na', 'null', 'none', '']:
+                return 0.0
+            num_val = float(str_val)
+            return max(0.0, num_val)
+        except (ValueError, TypeError):
+            logger.warning("Could not convert value to float, using 0.0", extra={'value': value})
+            return 0.0
+    
+    return {
+        'food_id': api_food.get('food_id') or api_food.get('ID') or api_food.get('id'),
+        'name': api_food.get('name', ''),
+        'cal': safe_float(api_food.get('cal', 0)),
+        'protein': safe_float(api_food.get('protein', 0)),
+        'carbo': safe_float(api_food.get('carbo', 0)),
+        'fat': safe_float(api_food.get('fat', 0)),
+        'piece': api_food.get('piece', '100g'),
+        'original_response': api_food
+    }
+
+def normalize_food_name(name):
+    """Lowercase a food name, fold Hungarian (and other) diacritics and collapse punctuation"""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    folded = ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    return ' '.join(''.join(ch if ch.isalnum() else ' ' for ch in folded).split())
+
+def name_trigrams(normalized_name):
+    """Return the set of padded word trigrams of an already normalized name"""
+    trigrams = set()
+    for word in normalized_name.split():
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            trigrams.add(padded[i:i + 3])
+    return trigrams
+
+def index_food_trigrams(cursor, foods, replace=True):
+    """Store normalized names and trigrams for (food_mdm.id, name) rows
+    
+    Pass replace=False for rows that have never been indexed (name_normalized
+    is still NULL) to skip clearing their old trigrams.
+    """
+    normalized_rows = []
+    trigram_rows = []
+    for food_mdm_id, name in foods:
+        normalized = normalize_food_name(name)
+        normalized_rows.append((normalized, food_mdm_id))
+        trigram_rows.extend((trigram, food_mdm_id) for trigram in name_trigrams(normalized))
+    
+    if replace:
+        cursor.executemany('DELETE FROM food_mdm_trigrams WHERE food_mdm_id = ?', [(row[1],) for row in normalized_rows])
+    cursor.executemany('UPDATE food_mdm SET name_normalized = ? WHERE id = ?', normalized_rows)
+    cursor.executemany('INSERT OR IGNORE INTO food_mdm_trigrams (trigram, food_mdm_id) VALUES (?, ?)', trigram_rows)
+
+def save_food_to_mdm(food_data, portions_data=None):
+    """Save food data to master data management table for caching"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cleaned = clean_api_response(food_data)
+            food_id = cleaned['food_id']
+            
+            if not food_id:
+                return False
+                
+            cursor.execute('SELECT id FROM food_mdm WHERE food_id = ?', (food_id,))
+            if cursor.fetchone():
+                return True
+                
+            cursor.execute('''
+                INSERT INTO food_mdm 
+                (food_id, name, cal, protein, carbo, fat, piece, portions, api_response)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                food_id,
+                cleaned['name'],
+                cleaned['cal'],
+                cleaned['protein'],
+                cleaned['carbo'],
+                cleaned['fat'],
+                cleaned['piece'],
+                json.dumps(portions_data) if portions_data else None,
+                json.dumps(cleaned['original_response'])
+            ))
+            index_food_trigrams(cursor, [(cursor.lastrowid, cleaned['name'])], replace=False)
+            
+            conn.commit()
+            return True
+            
+        except Exception as e:
+            db_logger.error("Error saving to MDM", extra={'error': str(e)})
+            return False
+
+def upsert_foods(cursor, foods):
+    """Insert or refresh API foods in food_mdm on an open cursor (caller commits); returns the count"""
+    rows = {}
+    for food in foods:
+        cleaned = clean_api_response(food)
+        if cleaned['food_id']:
+            rows[str(cleaned['food_id'])] = (
+                str(cleaned['food_id']),
+                cleaned['name'],
+                cleaned['cal'],
+                cleaned['protein'],
+                cleaned['carbo'],
+                cleaned['fat'],
+                cleaned['piece'],
+                json.dumps(cleaned['original_response'])
+            )
+    if not rows:
+        return 0
+    
+    cursor.executemany('''
+        INSERT INTO food_mdm (food_id, name, cal, protein, carbo, fat, piece, api_response)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (food_id) DO UPDATE SET
+            name = excluded.name,
+            cal = excluded.cal,
+            protein = excluded.protein,
+            carbo = excluded.carbo,
+            fat = excluded.fat,
+            piece = excluded.piece,
+            api_response = excluded.api_response,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE food_mdm.api_response IS NOT excluded.api_response
+    ''', list(rows.values()))
+    
+    # Re-index trigrams only for new rows and renamed foods
+    food_ids = list(rows)
+    placeholders = ', '.join('?' * len(food_ids))
+    cursor.execute(f'''
+        SELECT id, name, name_normalized FROM food_mdm WHERE food_id IN ({placeholders})
+    ''', food_ids)
+    new, renamed = [], []
+    for food_mdm_id, name, normalized in cursor.fetchall():
+        if normalized is None:
+            new.append((food_mdm_id, name))
+        elif normalized != normalize_food_name(name):
+            renamed.append((food_mdm_id, name))
+    if new:
+        index_food_trigrams(cursor, new, replace=False)
+    if renamed:
+        index_food_trigrams(cursor, renamed)
+    
+    return len(rows)
+
+def upsert_foods_to_mdm(foods):
+    """Insert or refresh a batch of API foods in food_mdm in a single transaction"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            count = upsert_foods(cursor, foods)
+            conn.commit()
+            return count
+            
+        except Exception as e:
+            db_logger.error("Error upserting foods to MDM", extra={'error': str(e)})
+            conn.rollback()
+            return 0
+
+class FoodWriteBehind:
+    """Background queue that batches foods returned by /search into food_mdm
+
+    Request threads only enqueue; a daemon worker drains the queue every
+    ``flush_interval`` seconds or ``batch_size`` foods, whichever comes first.
+    When the queue is full new foods are dropped, never blocking a request.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_queue):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='mdm-write-behind', daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, foods):
+        self._ensure_started()
+        for food in foods:
+            try:
+                self._queue.put_nowait(food)
+                self.enqueued += 1
+            except queue.Full:
+                self.dropped += 1
+
+    def _drain(self, first):
+        batch = [first]
+        flush_at = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain(self._queue.get())
+            self.written += upsert_foods_to_mdm(batch)
+            self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Write out everything queued so far (used at shutdown)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.written += upsert_foods_to_mdm(batch)
+            self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'batches': self.batches
+        }
+
+food_write_behind = FoodWriteBehind(MDM_WRITE_BEHIND_BATCH, MDM_WRITE_BEHIND_INTERVAL, MDM_WRITE_BEHIND_QUEUE)
+atexit.register(food_write_behind.flush)
+
+def build_fts_query(query):
+    """Turn free text into an FTS5 query that prefix-matches every term"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+def fuzzy_search_food_ids(cursor, query, limit):
+    """Rank food_mdm ids by trigram similarity to an accent-folded query"""
+    query_trigrams = name_trigrams(normalize_food_name(query))
+    if not query_trigrams:
+        return []
+    
+    query_trigrams = sorted(query_trigrams)
+    placeholders = ', '.join('?' * len(query_trigrams))
+    
+    cursor.execute(f'''
+        SELECT trigram, COUNT(*) FROM food_mdm_trigrams
+        WHERE trigram IN ({placeholders})
+        GROUP BY trigram
+    ''', query_trigrams)
+    counts = dict(cursor.fetchall())
+    frequencies = sorted((counts.get(trigram, 0), trigram) for trigram in query_trigrams)
+    
+    # A match must share ceil(min_similarity * n) of the n query trigrams, so it is
+    # guaranteed to contain one of the n - that + 1 rarest; only those are probed
+    required = math.ceil(FUZZY_SEARCH_MIN_SIMILARITY * len(query_trigrams))
+    probe_trigrams = [trigram for count, trigram in frequencies[:len(query_trigrams) - required + 1] if count]
+    if not probe_trigrams:
+        return []
+    
+    # Keep the candidates that hit the most probed trigrams, then count their full
+    # overlap with the query through primary-key seeks
+    probe_placeholders = ', '.join('?' * len(probe_trigrams))
+    cursor.execute(f'''
+        SELECT ranked.food_mdm_id, ranked.shared, f.name_normalized
+        FROM (
+            SELECT candidate.food_mdm_id, (
+                SELECT COUNT(*) FROM food_mdm_trigrams t
+                WHERE t.trigram IN ({placeholders}) AND t.food_mdm_id = candidate.food_mdm_id
+            ) AS shared
+            FROM (
+                SELECT food_mdm_id FROM food_mdm_trigrams
+                WHERE trigram IN ({probe_placeholders})
+                GROUP BY food_mdm_id
+                ORDER BY COUNT(*) DESC, food_mdm_id
+                LIMIT ?
+            ) AS candidate
+        ) AS ranked
+        JOIN food_mdm f ON f.id = ranked.food_mdm_id
+        WHERE ranked.shared >= ?
+    ''', query_trigrams + probe_trigrams + [FUZZY_SEARCH_CANDIDATE_LIMIT, required])
+    
+    query_trigrams = set(query_trigrams)
+    ranked = []
+    for food_mdm_id, shared, normalized in cursor.fetchall():
+        # Share of the query that was found, with whole-name Jaccard as tie-breaker
+        coverage = shared / len(query_trigrams)
+        jaccard = shared / len(query_trigrams | name_trigrams(normalized or ''))
+        ranked.append((coverage, jaccard, food_mdm_id))
+    
+    ranked.sort(reverse=True)
+    return [food_mdm_id for _, _, food_mdm_id in ranked[:limit]]
+
+def search_local_mdm(query):
+    """Search local food database for cached food items"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            fts_query = build_fts_query(query)
+            if not fts_query:
+                return []
+            
+            if FOOD_FTS_ENABLED:
+                cursor.execute('''
+                    SELECT f.food_id, f.name, f.cal, f.protein, f.carbo, f.fat, f.piece, f.portions, f.api_response
+                    FROM food_mdm_fts
+                    JOIN food_mdm f ON f.id = food_mdm_fts.rowid
+                    WHERE food_mdm_fts MATCH ?
+                    ORDER BY bm25(food_mdm_fts), f.name
+                    LIMIT 20
+                ''', (fts_query,))
+            else:
+                cursor.execute('''
+                    SELECT food_id, name, cal, protein, carbo, fat, piece, portions, api_response
+                    FROM food_mdm 
+                    WHERE name LIKE ? 
+                    ORDER BY name
+                    LIMIT 20
+                ''', (f'%{query}%',))
+            rows = cursor.fetchall()
+            
+            # Too few exact hits: add accent-insensitive, typo-tolerant trigram matches
+            if len(rows) < FUZZY_SEARCH_MIN_RESULTS:
+                fuzzy_ids = fuzzy_search_food_ids(cursor, query, 20 - len(rows))
+                if fuzzy_ids:
+                    placeholders = ', '.join('?' * len(fuzzy_ids))
+                    cursor.execute(f'''
+                        SELECT id, food_id, name, cal, protein, carbo, fat, piece, portions, api_response
+                        FROM food_mdm WHERE id IN ({placeholders})
+                    ''', fuzzy_ids)
+                    fuzzy_rows = {row[0]: row[1:] for row in cursor.fetchall()}
+                    
+                    seen_food_ids = {row[0] for row in rows}
+                    for food_mdm_id in fuzzy_ids:
+                        row = fuzzy_rows.get(food_mdm_id)
+                        if row and row[0] not in seen_food_ids:
+                            seen_food_ids.add(row[0])
+                            rows.append(row)
+            
+            results = []
+            for row in rows:
+                food_id, name, cal, protein, carbo, fat, piece, portions, api_response = row
+                
+                food = {
+                    'food_id': food_id,
+                    'name': name,
+                    'cal': cal,
+                    'protein': protein,
+                    'carbo': carbo,
+                    'fat': fat,
+                    'piece': piece,
+                    'source': 'local',
+                    'portions': json.loads(portions) if portions else None
+                }
+                
+                if api_response:
+                    original = json.loads(api_response)
+                    food.update(original)
+                    food['source'] = 'local'
+                    
+                results.append(food)
+                
+            return results
+            
+        except Exception as e:
+            search_logger.error("Error searching local MDM", extra={'error': str(e)})
+            return []
+
+def build_meal_log_row(food_data, meal_type, quantity, date_eaten, user_id):
+    """Compute the meal_log row for a food and quantity; raises ValueError on a bad quantity"""
+    if date_eaten:
+        if isinstance(date_eaten, str):
+            try:
+                parsed_date = datetime.strptime(date_eaten, '%Y-%m-%d').date()
+                date_eaten = parsed_date
+            except ValueError:
+                meal_logger.warning("Invalid date format, using today", extra={'date_eaten': date_eaten})
+                date_eaten = datetime.now().date()
+    else:
+        date_eaten = datetime.now().date()
+    
+    food_id = food_data.get('food_id') or food_data.get('ID') or food_data.get('id') or food_data.get('fid')
+    if not food_id:
+        food_name = food_data.get('name', 'unknown')
+        food_id = f"custom_{hashlib.md5(food_name.encode()).hexdigest()[:8]}"
+    
+    try:
+        multiplier = float(quantity) / 100.0
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid quantity value: {quantity}")
+    
+    def safe_float(value):
+        if not value:
+            return 0.0
+        try:
+            str_val = str(value).strip()
+            str_val = str_val.replace('kcal', '').replace('cal', '').replace('g', '').strip()
+            if not str_val or str_val.lower() in ['n/a', 'na', 'null', 'none', '']:
+                return 0.0
+            num_val = float(str_val)
+            return max(0.0, min(num_val, 10000.0))
+        except (ValueError, TypeError):
+            logger.warning("Could not convert value to float, using 0.0", extra={'value': value})
+            return 0.0
+    
+    cal = safe_float(food_data.get('cal', 0))
+    protein = safe_float(food_data.get('protein', 0))
+    carbo = safe_float(food_data.get('carbo', 0))
+    fat = safe_float(food_data.get('fat', 0))
+    
+    return (
+        user_id,
+        food_id,
+        food_data.get('name', ''),
+        meal_type,
+        float(quantity),
+        cal * multiplier,
+        protein * multiplier,
+        carbo * multiplier,
+        fat * multiplier,
+        date_eaten
+    )
+
+MEAL_LOG_INSERT = '''
+    INSERT INTO meal_log 
+    (user_id, food_id, food_name, meal_type, quantity, calories, protein, carbohydrates, fat, date_eaten)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def log_meal(food_data, meal_type, quantity, date_eaten=None, user_id=None):
+    """Log a meal entry to the database with calculated nutrition values; returns the new row id or False"""
+    if meal_logger.isEnabledFor(logging.DEBUG):
+        fields = {'user_id': user_id, 'meal_type': meal_type, 'quantity': quantity}
+        if LOG_PAYLOADS:
+            fields['food_data'] = food_data
+        meal_logger.debug("Logging meal", extra=fields)
+    
+    if not user_id:
+        meal_logger.error("Cannot log meal without a user_id")
+        return False
+    
+    if not food_data:
+        meal_logger.error("Cannot log meal without food_data", extra={'user_id': user_id})
+        return False
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            try:
+                row = build_meal_log_row(food_data, meal_type, quantity, date_eaten, user_id)
+            except ValueError as e:
+                meal_logger.error("Invalid meal entry", extra={'user_id': user_id, 'error': str(e)})
+                return False
+            
+            cursor.execute(MEAL_LOG_INSERT, row)
+            
+            conn.commit()
+            row_id = cursor.lastrowid
+            meal_logger.debug("Meal logged", extra={'meal_id': row_id, 'calories': row[5]})
+            
+            return row_id
+            
+        except Exception:
+            meal_logger.exception("Error logging meal", extra={'user_id': user_id})
+            conn.rollback()
+            return False
+
+# ========================
+# UPSTREAM FOOD API CLIENT
+# ========================
+
+UPSTREAM_PAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'hu-HU,hu;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+UPSTREAM_API_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'Accept-Language': 'hu-HU,hu;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Referer': UPSTREAM_BASE_URL,
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+class UpstreamClient:
+    """Long-lived, connection-pooled HTTP client for kaloriabazis.hu
+
+    The landing page only has to be fetched to obtain session cookies, so the
+    warm-up GET runs once and is repeated only when the cookies expire or the
+    API answers with ``die_with_text`` (stale session).
+    """
+
+    def __init__(self, base_url, pool_size, connect_timeout, read_timeout, cookie_ttl):
+        self.base_url = base_url
+        self.api_url = base_url + 'getfood.php'
+        self.timeout = (connect_timeout, read_timeout)
+        self.cookie_ttl = cookie_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._primed_at = None
+
+    def _cookies_stale(self):
+        if self._primed_at is None:
+            return True
+        if time.monotonic() - self._primed_at > self.cookie_ttl:
+            return True
+        now = time.time()
+        return any(cookie.expires and cookie.expires < now for cookie in self.session.cookies)
+
+    def _timed_get(self, call, url, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self.session.get(url, timeout=self.timeout, **kwargs)
+            outcome = str(response.status_code)
+            return response
+        finally:
+            metrics.observe(
+                'foodapp_upstream_request_duration_seconds',
+                time.perf_counter() - started,
+                (('call', call), ('outcome', outcome))
+            )
+
+    def prime(self, force=False):
+        """Fetch the landing page to (re)obtain session cookies; returns True if a request was made"""
+        if not force and not self._cookies_stale():
+            return False
+        with self._lock:
+            if not force and not self._cookies_stale():
+                return False
+            self._timed_get('warmup', self.base_url, headers=UPSTREAM_PAGE_HEADERS)
+            self._primed_at = time.monotonic()
+            return True
+
+    def get_food(self, query, page):
+        """Call getfood.php, re-priming the cookies once if the session turned out to be stale"""
+        just_primed = self.prime()
+        params = {'fav': 'false', 'q': query, 'p': page}
+        response = self._timed_get('getfood', self.api_url, params=params, headers=UPSTREAM_API_HEADERS)
+        
+        if not just_primed and response.status_code == 200 and 'die_with_text' in response.text:
+            self.prime(force=True)
+            response = self._timed_get('getfood', self.api_url, params=params, headers=UPSTREAM_API_HEADERS)
+        
+        return response
+
+upstream_client = UpstreamClient(
+    UPSTREAM_BASE_URL,
+    UPSTREAM_POOL_SIZE,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_COOKIE_TTL
+)
+
+class UpstreamError(Exception):
+    """Raised when kaloriabazis.hu answers with an error status or an unusable body"""
+
+def search_upstream(query, page):
+    """Search kaloriabazis.hu and return the parsed list of foods (empty when nothing matched)"""
+    response = upstream_client.get_food(query, page)
+    
+    if response.status_code != 200:
+        raise UpstreamError(f'kaloriabazis.hu returned HTTP {response.status_code}')
+    
+    text = response.text
+    if 'die_with_text' in text:
+        raise UpstreamError('kaloriabazis.hu rejected the session')
+    if len(text) < 50:
+        raise UpstreamError(f'kaloriabazis.hu returned a short body ({len(text)} bytes)')
+    
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise UpstreamError(f'kaloriabazis.hu returned invalid JSON: {e}')
+    if not isinstance(data, dict):
+        raise UpstreamError('kaloriabazis.hu returned an unexpected JSON document')
+    
+    if 'results2' in data and isinstance(data['results2'], list):
+        return data['results2']
+    elif 'results1' in data and isinstance(data['results1'], list):
+        return data['results1']
+    return []
+
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+def normalize_search_query(query):
+    """Normalize a search query for use as a cache key"""
+    return ' '.join(query.lower().split())
+
+def load_persisted_search(query, page):
+    """Read a non-expired upstream result list from the SQLite search cache"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT results, expires_at FROM search_cache
+                WHERE query = ? AND page = ? AND expires_at > ?
+            ''', (query, page, time.time()))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return json.loads(row[0]), row[1] - time.time()
+            
+        except Exception as e:
+            search_logger.error("Error reading search cache", extra={'error': str(e)})
+            return None
+
+search_cache_purged_at = 0.0
+
+def purge_search_cache(cursor):
+    """Delete expired persisted searches, at most once per SEARCH_CACHE_PURGE_INTERVAL"""
+    global search_cache_purged_at
+    now = time.time()
+    if now - search_cache_purged_at < SEARCH_CACHE_PURGE_INTERVAL:
+        return 0
+    search_cache_purged_at = now
+    cursor.execute('DELETE FROM search_cache WHERE expires_at < ?', (now,))
+    return cursor.rowcount
+
+def persist_search(query, page, results):
+    """Store an upstream result list in the SQLite search cache"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO search_cache (query, page, results, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (query, page, json.dumps(results), time.time() + SEARCH_CACHE_TTL))
+            purge_search_cache(cursor)
+            conn.commit()
+            
+        except Exception as e:
+            search_logger.error("Error writing search cache", extra={'error': str(e)})
+
+def lookup_search_cache(key):
+    """Return cached upstream results for a (normalized query, page) key, or None"""
+    results = search_cache.get(key)
+    if results is None and SEARCH_CACHE_PERSIST:
+        persisted = load_persisted_search(*key)
+        if persisted:
+            results, remaining_ttl = persisted
+            search_cache.set(key, results, ttl=remaining_ttl)
+    return results
+
+def store_search_cache(key, results):
+    """Cache a non-empty upstream result list"""
+    if results:
+        search_cache.set(key, results)
+        if SEARCH_CACHE_PERSIST:
+            persist_search(key[0], key[1], results)
+
+class UpstreamUnavailableError(Exception):
+    """Raised when the circuit breaker is rejecting upstream calls"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls. Once ``reset_timeout`` seconds have passed a single probe
+    is let through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            
+            self.rejected += 1
+            return False
+
+    def release_probe(self):
+        """Hand back a half-open probe that allow_request() granted but was not used"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.trips += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key onto one in-flight Future"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.shared = 0
+
+    def join(self, key):
+        """Return the in-flight Future for key, or None"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+            return future
+
+    def submit(self, key, executor, fn, *args):
+        """Join the in-flight call for key, or start fn(*args) on executor as the new one
+        
+        Returns ``(future, started)``; ``started`` is False when another
+        thread's call was joined instead.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = executor.submit(fn, *args)
+            self._calls[key] = future
+            self.started += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'started': self.started, 'shared': self.shared}
+
+upstream_breaker = CircuitBreaker(UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_RESET)
+upstream_flights = SingleFlight()
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix='upstream-search')
+upstream_hedge_stats = {'hedged': 0, 'hedge_wins': 0, 'deadline_misses': 0}
+upstream_hedge_lock = threading.Lock()
+
+def upstream_hedging_stats():
+    with upstream_hedge_lock:
+        return dict(upstream_hedge_stats)
+
+def count_hedge_event(name):
+    """Increment one of the upstream_hedge_stats counters from a request thread"""
+    with upstream_hedge_lock:
+        upstream_hedge_stats[name] += 1
+
+def fetch_and_cache_upstream(key, query, page):
+    """Run one upstream search and cache it before the in-flight call completes"""
+    results = search_upstream(query, page)
+    store_search_cache(key, results)
+    if MDM_WRITE_BEHIND and results:
+        # Only real fetches feed food_mdm (cache hits were queued when fetched); the
+        # search route tags the returned dicts, so the worker gets copies
+        food_write_behind.enqueue([dict(food) for food in results])
+    return results
+
+class UpstreamSearchCall:
+    """A cached, hedged, deadline-bounded upstream search guarded by the circuit breaker
+
+    The network request starts as soon as the call is created, so callers can
+    do other work (such as the local search) before collecting ``result()``.
+    Concurrent calls for the same (normalized query, page) share a single
+    in-flight request; only the call that started it hedges and reports to
+    the circuit breaker.
+    """
+
+    def __init__(self, query, page, deadline):
+        self.query = query
+        self.page = page
+        self.deadline = deadline
+        self.key = (normalize_search_query(query), page)
+        self.results = lookup_search_cache(self.key)
+        self.futures = []
+        self.allowed = True
+        self.leader = False
+        
+        if self.results is None:
+            in_flight = upstream_flights.join(self.key)
+            if in_flight is not None:
+                self.futures.append(in_flight)
+                return
+            
+            self.allowed = upstream_breaker.allow_request()
+            if self.allowed:
+                future, self.leader = upstream_flights.submit(
+                    self.key, upstream_executor, fetch_and_cache_upstream, self.key, query, page
+                )
+                self.futures.append(future)
+                if not self.leader:
+                    # Another thread started this flight after join(); it owns the breaker report
+                    upstream_breaker.release_probe()
+
+    def _hedge_if_slow(self):
+        if not self.leader or UPSTREAM_HEDGE_DELAY <= 0 or upstream_breaker.state != CircuitBreaker.CLOSED:
+            return
+        hedge_at = min(time.monotonic() + UPSTREAM_HEDGE_DELAY, self.deadline)
+        done, _ = wait(self.futures, timeout=max(0, hedge_at - time.monotonic()))
+        if not done and time.monotonic() < self.deadline:
+            self.futures.append(
+                upstream_executor.submit(fetch_and_cache_upstream, self.key, self.query, self.page)
+            )
+            count_hedge_event('hedged')
+
+    def _wait(self):
+        self._hedge_if_slow()
+        
+        pending = set(self.futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, self.deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                count_hedge_event('deadline_misses')
+                raise FutureTimeoutError()
+            for future in done:
+                if future.exception() is None:
+                    if future is not self.futures[0]:
+                        count_hedge_event('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def result(self):
+        """Return a copy of the upstream foods, raising on breaker rejection, timeout or failure"""
+        if self.results is None:
+            if not self.allowed:
+                raise UpstreamUnavailableError('kaloriabazis.hu circuit breaker is open')
+            try:
+                self.results = self._wait()
+            except Exception:
+                if self.leader:
+                    upstream_breaker.record_failure()
+                raise
+            if self.leader:
+                upstream_breaker.record_success()
+        
+        # Hand out copies so callers can annotate results without touching the cache
+        return [dict(result) for result in self.results]
+
+# ========================
+# NOTIFICATIONS
+# ========================
+
+class NotificationSubscription:
+    """One connected stream's buffer; flagged for resync if it overflows"""
+
+    def __init__(self, user_id, buffer_size):
+        self.user_id = user_id
+        self.events = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+class NotificationHub:
+    """In-process pub/sub feeding the notification event streams
+    
+    Publishers call ``publish`` after committing; subscribers only wait on
+    their queue, so an idle stream costs no database queries. Each worker
+    process has its own hub and connection limit.
+    """
+
+    def __init__(self, max_connections, buffer_size):
+        self.max_connections = max_connections
+        self.buffer_size = buffer_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.published = 0
+        self.rejected = 0
+
+    def subscribe(self, user_id):
+        """Register a stream for user_id, or return None when the worker is at its limit"""
+        with self._lock:
+            if self.connections >= self.max_connections:
+                self.rejected += 1
+                return None
+            subscription = NotificationSubscription(user_id, self.buffer_size)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self.connections += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.connections -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push((event, data))
+
+    def publish_range(self, first_user_id, last_user_id, event, data):
+        """Publish to the streams of every user id in first_user_id..last_user_id"""
+        with self._lock:
+            subscribers = [
+                subscription for user_id, group in self._subscribers.items()
+                if first_user_id <= user_id <= last_user_id for subscription in group
+            ]
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push((event, data))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'max_connections': self.max_connections,
+                'users': len(self._subscribers),
+                'published': self.published,
+                'rejected': self.rejected
+            }
+
+notification_hub = NotificationHub(NOTIFICATION_STREAM_MAX, NOTIFICATION_STREAM_BUFFER)
+
+def format_sse(event, data):
+    """Encode one server-sent event, serialized like the JSON API responses"""
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+def count_unread_notifications(cursor, user_id):
+    """Read the trigger-maintained unread counter (constant time regardless of history)"""
+    cursor.execute('SELECT unread_count FROM notification_unread WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+class AnnouncementFanout:
+    """Daemon worker that delivers pending announcement_jobs as per-user notifications
+    
+    Each chunk is one set-based INSERT ... SELECT over a users id range plus a
+    compare-and-set on the job's last_user_id in the same transaction, so the
+    job resumes where it stopped after a restart and concurrent workers never
+    deliver a chunk twice. Once a chunk commits, the open streams of its users
+    get a 'resync' event.
+    """
+
+    def __init__(self, chunk_size, pause):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._thread = None
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.delivered = 0
+        self.completed = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run_pending, name='announcement-fanout', daemon=True)
+                self._thread.start()
+
+    def run_pending(self):
+        try:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT key FROM announcement_jobs WHERE completed_at IS NULL ORDER BY created_at')
+                keys = [row[0] for row in cursor.fetchall()]
+            
+            for key in keys:
+                while self._run_chunk(key):
+                    time.sleep(self.pause)
+                    
+        except Exception:
+            logger.exception("Announcement fan-out failed")
+
+    def _run_chunk(self, key):
+        """Deliver the next chunk of one job; returns False once the job is finished"""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT title, message, type, action_url, max_user_id, last_user_id
+                    FROM announcement_jobs WHERE key = ? AND completed_at IS NULL
+                ''', (key,))
+                job = cursor.fetchone()
+                if job is None:
+                    return False
+                title, message, notification_type, action_url, max_user_id, last_user_id = job
+                
+                cursor.execute('''
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM users WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+                    )
+                ''', (last_user_id, max_user_id, self.chunk_size))
+                chunk_end = cursor.fetchone()[0]
+                
+                if chunk_end is None:
+                    cursor.execute('''
+                        UPDATE announcement_jobs SET completed_at = CURRENT_TIMESTAMP
+                        WHERE key = ? AND completed_at IS NULL
+                    ''', (key,))
+                    conn.commit()
+                    self.completed += 1
+                    logger.info("Announcement delivered", extra={'key': key})
+                    return False
+                
+                cursor.execute('''
+                    UPDATE announcement_jobs SET last_user_id = ?
+                    WHERE key = ? AND last_user_id = ?
+                ''', (chunk_end, key, last_user_id))
+                if cursor.rowcount == 0:
+                    # Another worker claimed this chunk first
+                    conn.rollback()
+                    return True
+                
+                cursor.execute('''
+                    INSERT INTO notifications (user_id, title, message, type, action_url)
+                    SELECT id, ?, ?, ?, ? FROM users WHERE id > ? AND id <= ?
+                ''', (title, message, notification_type, action_url, last_user_id, chunk_end))
+                delivered = cursor.rowcount
+                cursor.execute('''
+                    UPDATE announcement_jobs SET delivered = delivered + ? WHERE key = ?
+                ''', (delivered, key))
+                conn.commit()
+                # Open streams of this chunk's users refetch their list
+                notification_hub.publish_range(last_user_id + 1, chunk_end, 'resync', {})
+                
+                self.chunks += 1
+                self.delivered += delivered
+                return True
+                
+            except Exception:
+                conn.rollback()
+                raise
+
+    def stats(self):
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'chunks': self.chunks,
+            'delivered': self.delivered,
+            'completed': self.completed
+        }
+
+announcement_fanout = AnnouncementFanout(ANNOUNCEMENT_FANOUT_CHUNK, ANNOUNCEMENT_FANOUT_PAUSE)
+
+# ========================
+# STATIC ASSETS
+# ========================
+
+def content_digest(body):
+    """Short content hash used for ETags and fingerprinted file names"""
+    return hashlib.sha256(body).hexdigest()[:12]
+
+def fingerprint_name(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+class StaticAsset:
+    """One frontend file held in memory with precompressed variants and a content-hash ETag"""
+
+    def __init__(self, name, body, path, mtime):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.body = body
+        self.digest = content_digest(body)
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type.endswith('javascript'):
+            self.content_type += '; charset=utf-8'
+        self.variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    @property
+    def fingerprinted_name(self):
+        return fingerprint_name(self.name, self.digest)
+
+    def etag(self, encoding=None):
+        return f"{self.digest}-{encoding}" if encoding else self.digest
+
+class AssetStore:
+    """Loads the frontend files once and rebuilds them when they change (in reload mode)
+    
+    index.html is rendered with its script and stylesheet references pointed
+    at the fingerprinted ``assets/`` URLs, so it is served with ``no-cache``
+    while the files it references can be cached as immutable. When the build
+    manifest exists, files are read from the bundle it describes instead,
+    except in reload mode, where the sources are always served.
+    """
 
-# ========================
-# AUTHENTICATION FUNCTIONS
-# ========================
+    def __init__(self, root, names, page, bundle_dir=None):
+        self.root = root
+        self.names = names
+        self.page = page
+        self.bundle_dir = bundle_dir
+        self._assets = {}
+        self._by_fingerprint = {}
+        self._lock = threading.Lock()
 
-def hash_password(password):
-    """Simple password hashing using SHA-256 with salt"""
-    salt = "food_app_salt_2024"
-    return hashlib.sha256((password + salt).encode()).hexdigest()
+    def _paths(self):
+        """Map each logical name to the file that backs it: the bundle's if built, else the source"""
+        manifest_path = os.path.join(self.bundle_dir, 'manifest.json') if self.bundle_dir else None
+        if manifest_path and os.path.exists(manifest_path) and not (ASSET_RELOAD or app.debug):
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            return {name: os.path.join(self.bundle_dir, manifest[name]) for name in self.names + (self.page,)}
+        return {name: os.path.join(self.root, name) for name in self.names + (self.page,)}
 
-def verify_password(password, hashed):
-    """Verify password against hash"""
-    return hash_password(password) == hashed
+    def _mtimes(self):
+        return {name: (path, os.stat(path).st_mtime_ns) for name, path in self._paths().items()}
 
-def require_auth(f):
-    """Decorator to require authentication for protected routes"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': 'Authentication required'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
+    def load(self):
+        mtimes = self._mtimes()
+        assets = {}
+        for name in self.names:
+            path, mtime = mtimes[name]
+            with open(path, 'rb') as f:
+                assets[name] = StaticAsset(name, f.read(), path, mtime)
+        
+        path, mtime = mtimes[self.page]
+        with open(path, encoding='utf-8') as f:
+            page = f.read()
+        for name, asset in assets.items():
+            page = page.replace(f'"{name}"', f'"assets/{asset.fingerprinted_name}"')
+        assets[self.page] = StaticAsset(self.page, page.encode('utf-8'), path, mtime)
+        
+        with self._lock:
+            self._assets = assets
+            self._by_fingerprint = {asset.fingerprinted_name: asset for asset in assets.values()}
+        return assets
 
-# ========================
-# FOOD DATA PROCESSING
-# ========================
+    def _current(self):
+        if ASSET_RELOAD or app.debug:
+            assets = self._assets
+            try:
+                changed = any(
+                    (assets[name].path, assets[name].mtime) != current
+                    for name, current in self._mtimes().items()
+                )
+            except (KeyError, OSError, ValueError):
+                changed = True
+            if changed:
+                return self.load()
+        return self._assets
 
-def clean_api_response(api_food):
-    """Clean and normalize API response data for consistent storage"""
-    def safe_float(value):
-        if not value:
-            return 0.0
-        try:
-            str_val = str(value).strip()
-            str_val = str_val.replace('kcal', '').replace('cal', '').replace('g', '').strip()
-            if not str_val or str_val.lower() in ['n/a', 'na', 'null', 'none', '']:
-                return 0.0
-            num_val = float(str_val)
-            return max(0.0, num_val)
-        except (ValueError, TypeError):
-            print(f"Warning: Could not convert '{value}' to float, using 0.0")
-            return 0.0
-    
-    return {
-        'food_id': api_food.get('food_id') or api_food.get('ID') or api_food.get('id'),
-        'name': api_food.get('name', ''),
-        'cal': safe_float(api_food.get('cal', 0)),
-        'protein': safe_float(api_food.get('protein', 0)),
-        'carbo': safe_float(api_food.get('carbo', 0)),
-        'fat': safe_float(api_food.get('fat', 0)),
-        'piece': api_food.get('piece', '100g'),
-        'original_response': api_food
-    }
+    def get(self, name):
+        return self._current().get(name)
 
-def save_food_to_mdm(food_data, portions_data=None):
-    """Save food data to master data management table for caching"""
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    cursor = conn.cursor()
+    def get_fingerprinted(self, filename):
+        """Return (asset, exact) for an assets/ URL; stale fingerprints resolve to the current file"""
+        self._current()
+        asset = self._by_fingerprint.get(filename)
+        if asset is not None:
+            return asset, True
+        stem, ext = os.path.splitext(filename)
+        return self.get(stem.rsplit('.', 1)[0] + ext), False
+
+# Rules whose selectors all start with one of these are inlined for the first (login) paint
+CRITICAL_CSS_SELECTORS = (
+    '*', 'html', 'body', '.initial-loading', '.spinner', '.login-', '.app-container',
+    '.form-group', '.form-switch', '.btn', '.error', '.success'
+)
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'delete', 'throw')
+JS_TIGHT_PUNCTUATION = set('{}();,=:<>!&|?[]*%^~')
+CSS_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', re.S)
+
+def minify_js(source):
+    """Conservative JavaScript minifier: drops comments and indentation, keeps line breaks for ASI
     
-    try:
-        cleaned = clean_api_response(food_data)
-        food_id = cleaned['food_id']
-        
-        if not food_id:
-            return False
-            
-        cursor.execute('SELECT id FROM food_mdm WHERE food_id = ?', (food_id,))
-        if cursor.fetchone():
+    Strings, template literals and regex literals are copied verbatim.
+    """
+    out = []
+    i, n = 0, len(source)
+    
+    def last_char():
+        return out[-1][-1] if out and out[-1] else ''
+    
+    def regex_allowed():
+        tail = ''.join(out[-3:]).rstrip()
+        if not tail:
             return True
-            
-        cursor.execute('''
-            INSERT INTO food_mdm 
-            (food_id, name, cal, protein, carbo, fat, piece, portions, api_response)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            food_id,
-            cleaned['name'],
-            cleaned['cal'],
-            cleaned['protein'],
-            cleaned['carbo'],
-            cleaned['fat'],
-            cleaned['piece'],
-            json.dumps(portions_data) if portions_data else None,
-            json.dumps(cleaned['original_response'])
-        ))
-        
-        conn.commit()
-        return True
-        
-    except Exception as e:
-        print(f"Error saving to MDM: {e}")
-        return False
-    finally:
-        conn.close()
-
-def search_local_mdm(query):
-    """Search local food database for cached food items"""
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    cursor = conn.cursor()
+        if tail[-1] in JS_REGEX_PRECEDERS:
+            return True
+        return any(tail.endswith(keyword) and not (tail[:-len(keyword)][-1:].isalnum() or tail[:-len(keyword)][-1:] in '_$')
+                   for keyword in JS_REGEX_KEYWORDS)
     
-    try:
-        cursor.execute('''
-            SELECT food_id, name, cal, protein, carbo, fat, piece, portions, api_response
-            FROM food_mdm 
-            WHERE name LIKE ? 
-            ORDER BY name
-            LIMIT 20
-        ''', (f'%{query}%',))
+    while i < n:
+        char = source[i]
+        
+        if char in '"\'`':
+            end = i + 1
+            while end < n and source[end] != char:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+        
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            if last_char() not in ('', ' ', '\n'):
+                out.append(' ')
+        
+        elif char == '/' and regex_allowed():
+            end, in_class = i + 1, False
+            while end < n and source[end] != '\n':
+                if source[end] == '\\':
+                    end += 2
+                    continue
+                if source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                elif source[end] == '/' and not in_class:
+                    break
+                end += 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        
+        elif char.isspace():
+            end = i
+            while end < n and source[end].isspace():
+                end += 1
+            newline = '\n' in source[i:end]
+            following = source[end] if end < n else ''
+            previous = last_char()
+            if out and out[-1] == ' ':
+                out.pop()
+                previous = last_char()
+            if not previous or previous == '\n':
+                pass
+            elif newline and previous not in '{;,':
+                out.append('\n')
+            elif not newline and previous not in JS_TIGHT_PUNCTUATION and following not in JS_TIGHT_PUNCTUATION:
+                out.append(' ')
+            i = end
         
-        results = []
-        for row in cursor.fetchall():
-            food_id, name, cal, protein, carbo, fat, piece, portions, api_response = row
-            
-            food = {
-                'food_id': food_id,
-                'name': name,
-                'cal': cal,
-                'protein': protein,
-                'carbo': carbo,
-                'fat': fat,
-                'piece': piece,
-                'source': 'local',
-                'portions': json.loads(portions) if portions else None
-            }
-            
-            if api_response:
-                original = json.loads(api_response)
-                food.update(original)
-                food['source'] = 'local'
-                
-            results.append(food)
-            
-        return results
-        
-    except Exception as e:
-        print(f"Error searching local MDM: {e}")
-        return []
-    finally:
-        conn.close()
+        else:
+            end = i + 1
+            while end < n and not source[end].isspace() and source[end] not in '"\'`/':
+                end += 1
+            out.append(source[i:end])
+            i = end
+    
+    return ''.join(out).strip() + '\n'
 
-def log_meal(food_data, meal_type, quantity, date_eaten=None, user_id=None):
-    """Log a meal entry to the database with calculated nutrition values"""
-    print(f"=== LOGGING MEAL ===")
-    print(f"Food data: {food_data}")
-    print(f"Meal type: {meal_type}")
-    print(f"Quantity: {quantity}")
-    print(f"User ID: {user_id}")
+def compact_css(text):
+    """Collapse whitespace in a run of CSS that holds no comments or strings"""
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}')
+
+def minify_css(source):
+    """Strip comments and redundant whitespace from a stylesheet, leaving quoted strings intact"""
+    out, text, position = [], [], 0
+    # Comments and strings are matched together so quotes in comments and /* in strings are inert
+    for match in CSS_TOKEN_RE.finditer(source):
+        text.append(source[position:match.start()])
+        position = match.end()
+        if match.group().startswith('/*'):
+            text.append(' ')
+        else:
+            out.extend((compact_css(''.join(text)), match.group()))
+            text = []
+    text.append(source[position:])
+    out.append(compact_css(''.join(text)))
+    return ''.join(out).strip()
+
+def split_css_blocks(css):
+    """Split minified CSS into top-level (prelude, body) blocks"""
+    blocks = []
+    depth, start, prelude = 0, 0, ''
+    for index, char in enumerate(css):
+        if char == '{':
+            if depth == 0:
+                prelude, start = css[start:index], index + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude.strip(), css[start:index]))
+                start = index + 1
+    return blocks
+
+def extract_critical_css(css):
+    """Pick the top-level rules needed for the login screen, plus the keyframes they animate with"""
+    rules = []
+    animations = set()
+    blocks = split_css_blocks(css)
+    for prelude, body in blocks:
+        if prelude.startswith('@'):
+            continue
+        selectors = [selector.strip() for selector in prelude.split(',')]
+        if all(selector.startswith(CRITICAL_CSS_SELECTORS) for selector in selectors):
+            rules.append(f"{prelude}{{{body}}}")
+            animations.update(re.findall(r'animation(?:-name)?:([\w-]+)', body))
+    for prelude, body in blocks:
+        if prelude.startswith('@keyframes') and prelude.split()[-1] in animations:
+            rules.append(f"{prelude}{{{body}}}")
+    return ''.join(rules)
+
+def build_asset_bundle(root, out_dir):
+    """Minify and fingerprint the frontend into out_dir and write its manifest; returns the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(root, 'app.js'), encoding='utf-8') as f:
+        script = minify_js(f.read()).encode('utf-8')
+    with open(os.path.join(root, 'style.css'), encoding='utf-8') as f:
+        stylesheet = minify_css(f.read())
+    with open(os.path.join(root, 'index.html'), encoding='utf-8') as f:
+        page = f.read()
     
-    if not user_id:
-        print("❌ Error: No user_id provided")
-        return False
+    # Render the login screen from inline CSS and fetch the full stylesheet without blocking
+    page = page.replace(
+        '<link rel="stylesheet" href="style.css">',
+        f'<style>{extract_critical_css(stylesheet)}</style>\n'
+        '    <link rel="preload" href="style.css" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+        '    <noscript><link rel="stylesheet" href="style.css"></noscript>'
+    )
     
-    if not food_data:
-        print("❌ Error: No food_data provided")
-        return False
+    outputs = {'app.js': script, 'style.css': stylesheet.encode('utf-8')}
+    manifest = {name: fingerprint_name(name, content_digest(body)) for name, body in outputs.items()}
+    outputs['index.html'] = page.encode('utf-8')
+    manifest['index.html'] = 'index.html'
     
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    cursor = conn.cursor()
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
     
-    try:
-        if date_eaten:
-            if isinstance(date_eaten, str):
-                try:
-                    parsed_date = datetime.strptime(date_eaten, '%Y-%m-%d').date()
-                    date_eaten = parsed_date
-                except ValueError:
-                    print(f"Invalid date format: {date_eaten}, using today")
-                    date_eaten = datetime.now().date()
-        else:
-            date_eaten = datetime.now().date()
-        
-        food_id = food_data.get('food_id') or food_data.get('ID') or food_data.get('id') or food_data.get('fid')
-        if not food_id:
-            food_name = food_data.get('name', 'unknown')
-            food_id = f"custom_{hashlib.md5(food_name.encode()).hexdigest()[:8]}"
-            print(f"Generated food_id: {food_id}")
-            
-        try:
-            multiplier = float(quantity) / 100.0
-            print(f"Quantity multiplier: {multiplier}")
-        except (ValueError, TypeError):
-            print(f"❌ Error: Invalid quantity value: {quantity}")
-            return False
-        
-        def safe_float(value):
-            if not value:
-                return 0.0
-            try:
-                str_val = str(value).strip()
-                str_val = str_val.replace('kcal', '').replace('cal', '').replace('g', '').strip()
-                if not str_val or str_val.lower() in ['n/a', 'na', 'null', 'none', '']:
-                    return 0.0
-                num_val = float(str_val)
-                return max(0.0, min(num_val, 10000.0))
-            except (ValueError, TypeError):
-                print(f"Warning: Could not convert '{value}' to float, using 0.0")
-                return 0.0
-        
-        cal = safe_float(food_data.get('cal', 0))
-        protein = safe_float(food_data.get('protein', 0))
-        carbo = safe_float(food_data.get('carbo', 0))
-        fat = safe_float(food_data.get('fat', 0))
-        
-        print(f"Base nutrition - Cal: {cal}, Protein: {protein}, Carbo: {carbo}, Fat: {fat}")
-        
-        calculated_cal = cal * multiplier
-        calculated_protein = protein * multiplier
-        calculated_carbo = carbo * multiplier
-        calculated_fat = fat * multiplier
-        
-        print(f"Calculated nutrition - Cal: {calculated_cal}, Protein: {calculated_protein}, Carbo: {calculated_carbo}, Fat: {calculated_fat}")
-        
-        cursor.execute('''
-            INSERT INTO meal_log 
-            (user_id, food_id, food_name, meal_type, quantity, calories, protein, carbohydrates, fat, date_eaten)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            food_id,
-            food_data.get('name', ''),
-            meal_type,
-            float(quantity),
-            calculated_cal,
-            calculated_protein,
-            calculated_carbo,
-            calculated_fat,
-            date_eaten
-        ))
-        
-        conn.commit()
-        row_id = cursor.lastrowid
-        print(f"✅ Meal logged successfully with ID: {row_id}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Error logging meal: {e}")
-        import traceback
-        traceback.print_exc()
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    for name, body in outputs.items():
+        with open(os.path.join(out_dir, manifest[name]), 'wb') as f:
+            f.write(body)
+    # Write the manifest last so a running server never sees it point at missing files
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    
+    for name, filename in previous.items():
+        if filename != manifest.get(name) and os.path.exists(os.path.join(out_dir, filename)):
+            os.remove(os.path.join(out_dir, filename))
+    return manifest
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify and fingerprint app.js, style.css and index.html into ASSET_BUNDLE_DIR"""
+    manifest = build_asset_bundle(ASSET_DIR, ASSET_BUNDLE_DIR)
+    for name, filename in manifest.items():
+        source = os.path.getsize(os.path.join(ASSET_DIR, name))
+        built = os.path.getsize(os.path.join(ASSET_BUNDLE_DIR, filename))
+        print(f"✅ {name} -> {filename} ({source} -> {built} bytes)")
+
+def serve_asset(asset, cache_control):
+    """Serve an in-memory asset, negotiating br/gzip and answering If-None-Match with 304"""
+    accepted = request.accept_encodings
+    encoding = next((name for name in ('br', 'gzip') if name in asset.variants and accepted[name]), None)
+    etag = asset.etag(encoding)
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(asset.variants[encoding] if encoding else asset.body, content_type=asset.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+asset_store = AssetStore(ASSET_DIR, ('app.js', 'style.css'), 'index.html', ASSET_BUNDLE_DIR)
+asset_store.load()
 
 # ========================
 # FLASK ROUTES
 # ========================
 
+@app.before_request
+def start_request_timer():
+    """Stamp the request start time for the latency histogram"""
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request by status and record its latency under the matched route"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('foodapp_http_request_duration_seconds', time.perf_counter() - started, (('route', route), ('method', request.method)))
+        metrics.inc('foodapp_http_requests_total', (('route', route), ('method', request.method), ('status', response.status_code)))
+    return response
+
+@app.after_request
+def attach_sql_profile(response):
+    """Summarize the request's SQL in headers when profiling with SQL_PROFILE_HEADER (or ?sql_profile=1 in debug)"""
+    entries = g.pop('sql_profile', None)
+    if not entries:
+        return response
+    
+    summary = summarize_sql_profile(entries)
+    if SQL_PROFILE_HEADER or (app.debug and request.args.get('sql_profile')):
+        response.headers['Server-Timing'] = f'sql;dur={summary["total_ms"]};desc="{summary["count"]} statements"'
+        response.headers['X-SQL-Profile'] = json.dumps(summary, ensure_ascii=True)
+    if sql_logger.isEnabledFor(logging.DEBUG):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        sql_logger.debug("Request SQL profile", extra={'route': route, **summary})
+    return response
+
 @app.route('/')
 def home():
     """Main route that serves the HTML page"""
-    return open('index.html').read()
+    return serve_asset(asset_store.get('index.html'), 'no-cache')
+
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """Serve a fingerprinted frontend asset; immutable unless the fingerprint is stale"""
+    asset, exact = asset_store.get_fingerprinted(filename)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    if not exact:
+        return serve_asset(asset, 'no-cache')
+    return serve_asset(asset, f'public, max-age={ASSET_MAX_AGE}, immutable')
+
+@app.route('/app.js')
+@app.route('/style.css')
+def plain_asset():
+    """Serve unfingerprinted asset URLs from memory, revalidated via ETag"""
+    return serve_asset(asset_store.get(request.path.lstrip('/')), 'no-cache')
 
 @app.route('/check_auth')
 def check_auth():
     """Check if user is currently authenticated"""
     if 'user_id' in session:
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        try:
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            base_columns = ['id', 'username', 'email', 'first_name', 'last_name', 'height', 'weight', 'age', 'activity_level', 'daily_calorie_goal']
-            macro_columns = ['macro_preset', 'carbs_percent', 'protein_percent', 'fat_percent']
-            
-            available_macro_columns = [col for col in macro_columns if col in columns]
-            all_columns = base_columns + available_macro_columns
-            
-            query = f"SELECT {', '.join(all_columns)} FROM users WHERE id = ?"
-            cursor.execute(query, (session['user_id'],))
-            user_data = cursor.fetchone()
-            
-            if user_data:
-                user = {
-                    'id': user_data[0],
-                    'username': user_data[1],
-                    'email': user_data[2],
-                    'first_name': user_data[3],
-                    'last_name': user_data[4],
-                    'height': user_data[5],
-                    'weight': user_data[6],
-                    'age': user_data[7],
-                    'activity_level': user_data[8],
-                    'daily_calorie_goal': user_data[9]
-                }
-                
-                if 'macro_preset' in columns:
-                    macro_data_start = len(base_columns)
-                    user['macro_preset'] = user_data[macro_data_start] if len(user_data) > macro_data_start else 'balanced'
-                    user['carbs_percent'] = user_data[macro_data_start + 1] if len(user_data) > macro_data_start + 1 else 40
-                    user['protein_percent'] = user_data[macro_data_start + 2] if len(user_data) > macro_data_start + 2 else 30
-                    user['fat_percent'] = user_data[macro_data_start + 3] if len(user_data) > macro_data_start + 3 else 30
-                else:
-                    user['macro_preset'] = 'balanced'
-                    user['carbs_percent'] = 40
-                    user['protein_percent'] = 30
-                    user['fat_percent'] = 30
-                
-                return jsonify({'authenticated': True, 'user': user})
-        except Exception as e:
-            print(f"Error checking auth: {e}")
-        finally:
-            conn.close()
+        user = user_profile_cache.get(session['user_id'])
+        if user:
+            return jsonify({'authenticated': True, 'user': user})
+        
+        with get_db() as conn:
+            cursor = conn.cursor()
+            try:
+                user = cache_user_profile(cursor, session['user_id'])
+                if user:
+                    return jsonify({'authenticated': True, 'user': user})
+            except Exception as e:
+                auth_logger.error("Error checking auth", extra={'error': str(e)})
     
     return jsonify({'authenticated': False})
 
@@ -562,30 +2800,28 @@ def register():
         
         password_hash = hash_password(password)
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO users (username, email, password_hash, first_name, last_name)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (username, email, password_hash, first_name, last_name))
-            
-            conn.commit()
-            return jsonify({'success': True, 'message': 'User registered successfully'})
+        with get_db() as conn:
+            cursor = conn.cursor()
             
-        except sqlite3.IntegrityError as e:
-            if 'username' in str(e):
-                return jsonify({'error': 'Username already exists'}), 400
-            elif 'email' in str(e):
-                return jsonify({'error': 'Email already exists'}), 400
-            else:
-                return jsonify({'error': 'Registration failed'}), 400
-        finally:
-            conn.close()
+            try:
+                cursor.execute('''
+                    INSERT INTO users (username, email, password_hash, first_name, last_name)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (username, email, password_hash, first_name, last_name))
+                
+                conn.commit()
+                return jsonify({'success': True, 'message': 'User registered successfully'})
+                
+            except sqlite3.IntegrityError as e:
+                if 'username' in str(e):
+                    return jsonify({'error': 'Username already exists'}), 400
+                elif 'email' in str(e):
+                    return jsonify({'error': 'Email already exists'}), 400
+                else:
+                    return jsonify({'error': 'Registration failed'}), 400
             
     except Exception as e:
-        print(f"Registration error: {e}")
+        auth_logger.error("Registration error", extra={'error': str(e)})
         return jsonify({'error': 'Registration failed'}), 500
 
 @app.route('/login', methods=['POST'])
@@ -599,65 +2835,30 @@ def login():
         if not all([email, password]):
             return jsonify({'error': 'Missing email or password'}), 400
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            base_columns = ['id', 'password_hash', 'username', 'first_name', 'last_name', 'height', 'weight', 'age', 'activity_level', 'daily_calorie_goal']
-            macro_columns = ['macro_preset', 'carbs_percent', 'protein_percent', 'fat_percent']
+        with get_db() as conn:
+            cursor = conn.cursor()
             
-            available_macro_columns = [col for col in macro_columns if col in columns]
-            all_columns = base_columns + available_macro_columns
-            
-            query = f"SELECT {', '.join(all_columns)} FROM users WHERE email = ?"
-            cursor.execute(query, (email,))
+            cursor.execute(user_schema['select_login'], (email,))
             user_data = cursor.fetchone()
             
-            if user_data and verify_password(password, user_data[1]):
-                session['user_id'] = user_data[0]
-                user = {
-                    'id': user_data[0],
-                    'username': user_data[2],
-                    'email': email,
-                    'first_name': user_data[3],
-                    'last_name': user_data[4],
-                    'height': user_data[5],
-                    'weight': user_data[6],
-                    'age': user_data[7],
-                    'activity_level': user_data[8],
-                    'daily_calorie_goal': user_data[9]
-                }
-                
-                if 'macro_preset' in columns:
-                    macro_data_start = len(base_columns)
-                    user['macro_preset'] = user_data[macro_data_start] if len(user_data) > macro_data_start else 'balanced'
-                    user['carbs_percent'] = user_data[macro_data_start + 1] if len(user_data) > macro_data_start + 1 else 40
-                    user['protein_percent'] = user_data[macro_data_start + 2] if len(user_data) > macro_data_start + 2 else 30
-                    user['fat_percent'] = user_data[macro_data_start + 3] if len(user_data) > macro_data_start + 3 else 30
-                else:
-                    user['macro_preset'] = 'balanced'
-                    user['carbs_percent'] = 40
-                    user['protein_percent'] = 30
-                    user['fat_percent'] = 30
-                
+            if user_data and verify_password(password, user_data[0]):
+                user = user_row_to_dict(user_data[1:])
+                session['user_id'] = user['id']
+                user_profile_cache.set(user['id'], user)
                 return jsonify({'success': True, 'user': user})
             else:
                 return jsonify({'error': 'Invalid email or password'}), 401
-                
-        finally:
-            conn.close()
             
     except Exception as e:
-        print(f"Login error: {e}")
+        auth_logger.error("Login error", extra={'error': str(e)})
         return jsonify({'error': 'Login failed'}), 500
 
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """Handle user logout"""
-    session.pop('user_id', None)
+    user_id = session.pop('user_id', None)
+    if user_id is not None:
+        user_profile_cache.invalidate(user_id)
     return jsonify({'success': True})
 
 @app.route('/api/update_profile', methods=['POST'])
@@ -668,83 +2869,20 @@ def update_profile():
         data = request.get_json()
         user_id = session['user_id']
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            base_fields = [
-                'first_name = ?', 'last_name = ?', 'height = ?', 'weight = ?', 'age = ?',
-                'activity_level = ?', 'daily_calorie_goal = ?', 'updated_at = CURRENT_TIMESTAMP'
-            ]
-            base_values = [
-                data.get('first_name'),
-                data.get('last_name'),
-                data.get('height'),
-                data.get('weight'),
-                data.get('age'),
-                data.get('activity_level'),
-                data.get('daily_calorie_goal')
-            ]
+        with get_db() as conn:
+            cursor = conn.cursor()
             
-            if 'macro_preset' in columns:
-                base_fields.extend(['macro_preset = ?', 'carbs_percent = ?', 'protein_percent = ?', 'fat_percent = ?'])
-                base_values.extend([
-                    data.get('macro_preset'),
-                    data.get('carbs_percent'),
-                    data.get('protein_percent'),
-                    data.get('fat_percent')
-                ])
-            
-            update_query = f"UPDATE users SET {', '.join(base_fields)} WHERE id = ?"
-            cursor.execute(update_query, base_values + [user_id])
+            values = [data.get(col) for col in user_schema['update_columns']]
+            cursor.execute(user_schema['update_profile'], values + [user_id])
             conn.commit()
             
             # Return updated user data
-            base_columns = ['id', 'username', 'email', 'first_name', 'last_name', 'height', 'weight', 'age', 'activity_level', 'daily_calorie_goal']
-            macro_columns = ['macro_preset', 'carbs_percent', 'protein_percent', 'fat_percent']
-            
-            available_macro_columns = [col for col in macro_columns if col in columns]
-            all_columns = base_columns + available_macro_columns
-            
-            query = f"SELECT {', '.join(all_columns)} FROM users WHERE id = ?"
-            cursor.execute(query, (user_id,))
-            user_data = cursor.fetchone()
-            
-            user = {
-                'id': user_data[0],
-                'username': user_data[1],
-                'email': user_data[2],
-                'first_name': user_data[3],
-                'last_name': user_data[4],
-                'height': user_data[5],
-                'weight': user_data[6],
-                'age': user_data[7],
-                'activity_level': user_data[8],
-                'daily_calorie_goal': user_data[9]
-            }
-            
-            if 'macro_preset' in columns:
-                macro_data_start = len(base_columns)
-                user['macro_preset'] = user_data[macro_data_start] if len(user_data) > macro_data_start else 'balanced'
-                user['carbs_percent'] = user_data[macro_data_start + 1] if len(user_data) > macro_data_start + 1 else 40
-                user['protein_percent'] = user_data[macro_data_start + 2] if len(user_data) > macro_data_start + 2 else 30
-                user['fat_percent'] = user_data[macro_data_start + 3] if len(user_data) > macro_data_start + 3 else 30
-            else:
-                user['macro_preset'] = 'balanced'
-                user['carbs_percent'] = 40
-                user['protein_percent'] = 30
-                user['fat_percent'] = 30
+            user = cache_user_profile(cursor, user_id)
             
             return jsonify({'success': True, 'user': user})
             
-        finally:
-            conn.close()
-            
     except Exception as e:
-        print(f"Profile update error: {e}")
+        auth_logger.error("Profile update error", extra={'error': str(e)})
         return jsonify({'error': 'Profile update failed'}), 500
 
 # Goal setting routes
@@ -761,80 +2899,79 @@ def set_goal():
         target_date = data.get('target_date')
         custom_calories = data.get('custom_calories')
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT weight, height, age, activity_level, daily_calorie_goal
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            return jsonify({'error': 'User not found'}), 404
-        
-        current_weight, height, age, activity_level, current_calorie_goal = user_data
-        
-        bmr = calculate_bmr(current_weight, height, age)
-        tdee = calculate_tdee(bmr, activity_level)
-        
-        if goal_type == 'custom_calories':
-            calculated_daily_calories = custom_calories
-            target_weight = current_weight
-            target_date = None
-        elif goal_type == 'maintain':
-            calculated_daily_calories = int(tdee) if tdee else current_calorie_goal
-            target_weight = current_weight
-            target_date = None
-        else:
-            if not target_weight or not target_date:
-                return jsonify({'error': 'Target weight and date required for weight goals'}), 400
+        with get_db() as conn:
+            cursor = conn.cursor()
             
-            calculated_daily_calories = calculate_daily_calories_for_goal(
-                current_weight, target_weight, target_date, tdee, date.today()
-            )
-        
-        cursor.execute('''
-            UPDATE users SET 
-                goal_type = ?, 
-                target_weight = ?, 
-                target_date = ?, 
-                goal_created_date = ?,
-                calculated_daily_calories = ?,
-                daily_calorie_goal = ?,
-                bmr = ?,
-                tdee = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (goal_type, target_weight, target_date, date.today(), 
-              calculated_daily_calories, calculated_daily_calories, 
-              bmr, tdee, user_id))
-        
-        if goal_type in ['weight_loss', 'weight_gain'] and current_weight:
             cursor.execute('''
-                INSERT OR REPLACE INTO weight_logs (user_id, weight, log_date, notes)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, current_weight, date.today(), 'Goal setting - starting weight'))
-        
-        conn.commit()
-        
-        return jsonify({
-            'success': True,
-            'goal': {
-                'goal_type': goal_type,
-                'target_weight': target_weight,
-                'target_date': target_date,
-                'calculated_daily_calories': calculated_daily_calories,
-                'bmr': bmr,
-                'tdee': tdee
-            }
-        })
+                SELECT weight, height, age, activity_level, daily_calorie_goal
+                FROM users WHERE id = ?
+            ''', (user_id,))
+            user_data = cursor.fetchone()
+            
+            if not user_data:
+                return jsonify({'error': 'User not found'}), 404
+            
+            current_weight, height, age, activity_level, current_calorie_goal = user_data
+            
+            bmr = calculate_bmr(current_weight, height, age)
+            tdee = calculate_tdee(bmr, activity_level)
+            
+            if goal_type == 'custom_calories':
+                calculated_daily_calories = custom_calories
+                target_weight = current_weight
+                target_date = None
+            elif goal_type == 'maintain':
+                calculated_daily_calories = int(tdee) if tdee else current_calorie_goal
+                target_weight = current_weight
+                target_date = None
+            else:
+                if not target_weight or not target_date:
+                    return jsonify({'error': 'Target weight and date required for weight goals'}), 400
+                
+                calculated_daily_calories = calculate_daily_calories_for_goal(
+                    current_weight, target_weight, target_date, tdee, date.today()
+                )
+            
+            cursor.execute('''
+                UPDATE users SET 
+                    goal_type = ?, 
+                    target_weight = ?, 
+                    target_date = ?, 
+                    goal_created_date = ?,
+                    calculated_daily_calories = ?,
+                    daily_calorie_goal = ?,
+                    bmr = ?,
+                    tdee = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (goal_type, target_weight, target_date, date.today(), 
+                  calculated_daily_calories, calculated_daily_calories, 
+                  bmr, tdee, user_id))
+            
+            if goal_type in ['weight_loss', 'weight_gain'] and current_weight:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO weight_logs (user_id, weight, log_date, notes)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, current_weight, date.today(), 'Goal setting - starting weight'))
+            
+            conn.commit()
+            cache_user_profile(cursor, user_id)
+            
+            return jsonify({
+                'success': True,
+                'goal': {
+                    'goal_type': goal_type,
+                    'target_weight': target_weight,
+                    'target_date': target_date,
+                    'calculated_daily_calories': calculated_daily_calories,
+                    'bmr': bmr,
+                    'tdee': tdee
+                }
+            })
         
     except Exception as e:
-        print(f"Error setting goal: {e}")
+        logger.error("Error setting goal", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/log_weight', methods=['POST'])
 @require_auth
@@ -853,106 +2990,100 @@ def log_weight():
         if isinstance(log_date, str):
             log_date = datetime.strptime(log_date, '%Y-%m-%d').date()
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO weight_logs (user_id, weight, log_date, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, float(weight), log_date, notes))
-        
-        if log_date == date.today():
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute('''
-                UPDATE users SET weight = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (float(weight), user_id))
-        
-        conn.commit()
-        
-        return jsonify({'success': True, 'message': 'Weight logged successfully'})
+                INSERT OR REPLACE INTO weight_logs (user_id, weight, log_date, notes)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, float(weight), log_date, notes))
+            
+            if log_date == date.today():
+                cursor.execute('''
+                    UPDATE users SET weight = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (float(weight), user_id))
+            
+            conn.commit()
+            
+            if log_date == date.today():
+                cache_user_profile(cursor, user_id)
+            
+            return jsonify({'success': True, 'message': 'Weight logged successfully'})
         
     except Exception as e:
-        print(f"Error logging weight: {e}")
+        logger.error("Error logging weight", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/weight_history')
 @require_auth
 def get_weight_history():
     """Get weight history for progress tracking"""
     try:
-        user_id = session['user_id']
-        days = int(request.args.get('days', 30))
-        
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT weight, log_date, notes
-            FROM weight_logs 
-            WHERE user_id = ? AND log_date >= ?
-            ORDER BY log_date ASC
-        ''', (user_id, date.today() - timedelta(days=days)))
-        
-        weight_logs = []
-        for row in cursor.fetchall():
-            weight_logs.append({
-                'weight': row[0],
-                'date': row[1].isoformat(),
-                'notes': row[2]
-            })
-        
-        cursor.execute('''
-            SELECT goal_type, target_weight, target_date, goal_created_date, weight
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        
-        user_data = cursor.fetchone()
-        goal_data = None
-        projected_progress = []
+        user_id = session['user_id']
+        days = int(request.args.get('days', 30))
         
-        if user_data and user_data[0]:
-            goal_type, target_weight, target_date, goal_created_date, current_weight = user_data
+        with get_db() as conn:
+            cursor = conn.cursor()
             
-            goal_data = {
-                'goal_type': goal_type,
-                'target_weight': target_weight,
-                'target_date': target_date.isoformat() if target_date else None,
-                'goal_created_date': goal_created_date.isoformat() if goal_created_date else None
-            }
+            cursor.execute(WEIGHT_HISTORY, (user_id, date.today() - timedelta(days=days)))
+            
+            weight_logs = []
+            for row in cursor.fetchall():
+                weight_logs.append({
+                    'weight': row[0],
+                    'date': row[1].isoformat(),
+                    'notes': row[2]
+                })
+            
+            cursor.execute('''
+                SELECT goal_type, target_weight, target_date, goal_created_date, weight
+                FROM users WHERE id = ?
+            ''', (user_id,))
+            
+            user_data = cursor.fetchone()
+            goal_data = None
+            projected_progress = []
             
-            if goal_type in ['weight_loss', 'weight_gain'] and target_weight and target_date and goal_created_date:
-                start_date = goal_created_date
-                end_date = target_date
-                days_total = (end_date - start_date).days
+            if user_data and user_data[0]:
+                goal_type, target_weight, target_date, goal_created_date, current_weight = user_data
                 
-                if days_total > 0:
-                    current_date = max(start_date, date.today() - timedelta(days=days))
-                    while current_date <= min(end_date, date.today() + timedelta(days=30)):
-                        days_elapsed = (current_date - start_date).days
-                        progress_ratio = days_elapsed / days_total
-                        projected_weight = current_weight + (target_weight - current_weight) * progress_ratio
-                        
-                        projected_progress.append({
-                            'date': current_date.isoformat(),
-                            'weight': round(projected_weight, 1)
-                        })
-                        
-                        current_date += timedelta(days=1)
-        
-        return jsonify({
-            'success': True,
-            'weight_logs': weight_logs,
-            'goal_data': goal_data,
-            'projected_progress': projected_progress
-        })
+                goal_data = {
+                    'goal_type': goal_type,
+                    'target_weight': target_weight,
+                    'target_date': target_date.isoformat() if target_date else None,
+                    'goal_created_date': goal_created_date.isoformat() if goal_created_date else None
+                }
+                
+                if goal_type in ['weight_loss', 'weight_gain'] and target_weight and target_date and goal_created_date:
+                    start_date = goal_created_date
+                    end_date = target_date
+                    days_total = (end_date - start_date).days
+                    
+                    if days_total > 0:
+                        current_date = max(start_date, date.today() - timedelta(days=days))
+                        while current_date <= min(end_date, date.today() + timedelta(days=30)):
+                            days_elapsed = (current_date - start_date).days
+                            progress_ratio = days_elapsed / days_total
+                            projected_weight = current_weight + (target_weight - current_weight) * progress_ratio
+                            
+                            projected_progress.append({
+                                'date': current_date.isoformat(),
+                                'weight': round(projected_weight, 1)
+                            })
+                            
+                            current_date += timedelta(days=1)
+            
+            return jsonify({
+                'success': True,
+                'weight_logs': weight_logs,
+                'goal_data': goal_data,
+                'projected_progress': projected_progress
+            })
         
     except Exception as e:
-        print(f"Error getting weight history: {e}")
+        logger.error("Error getting weight history", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/goal_status')
 @require_auth
@@ -961,118 +3092,114 @@ def get_goal_status():
     try:
         user_id = session['user_id']
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT goal_type, target_weight, target_date, goal_created_date, 
-                   calculated_daily_calories, weight, bmr, tdee
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        
-        user_data = cursor.fetchone()
-        if not user_data or not user_data[0]:
-            return jsonify({'success': True, 'has_goal': False})
-        
-        goal_type, target_weight, target_date, goal_created_date, daily_calories, current_weight, bmr, tdee = user_data
-        
-        cursor.execute('''
-            SELECT weight, log_date FROM weight_logs 
-            WHERE user_id = ? ORDER BY log_date DESC LIMIT 1
-        ''', (user_id,))
-        
-        latest_weight_log = cursor.fetchone()
-        
-        goal_status = {
-            'has_goal': True,
-            'goal_type': goal_type,
-            'target_weight': target_weight,
-            'target_date': target_date.isoformat() if target_date else None,
-            'goal_created_date': goal_created_date.isoformat() if goal_created_date else None,
-            'daily_calorie_target': daily_calories,
-            'current_weight': current_weight,
-            'latest_logged_weight': latest_weight_log[0] if latest_weight_log else None,
-            'latest_weight_date': latest_weight_log[1].isoformat() if latest_weight_log else None,
-            'bmr': bmr,
-            'tdee': tdee
-        }
-        
-        if goal_type in ['weight_loss', 'weight_gain'] and target_weight and current_weight:
-            if latest_weight_log:
-                latest_weight = latest_weight_log[0]
-                total_change_needed = target_weight - current_weight
-                current_change = latest_weight - current_weight
-                
-                if total_change_needed != 0:
-                    progress_percentage = (current_change / total_change_needed) * 100
-                    goal_status['progress_percentage'] = round(progress_percentage, 1)
-                    goal_status['weight_change'] = round(current_change, 1)
-                    goal_status['weight_remaining'] = round(target_weight - latest_weight, 1)
-        
-        if target_date:
-            days_remaining = (target_date - date.today()).days
-            goal_status['days_remaining'] = days_remaining
-        
-        return jsonify({'success': True, **goal_status})
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT goal_type, target_weight, target_date, goal_created_date, 
+                       calculated_daily_calories, weight, bmr, tdee
+                FROM users WHERE id = ?
+            ''', (user_id,))
+            
+            user_data = cursor.fetchone()
+            if not user_data or not user_data[0]:
+                return jsonify({'success': True, 'has_goal': False})
+            
+            goal_type, target_weight, target_date, goal_created_date, daily_calories, current_weight, bmr, tdee = user_data
+            
+            cursor.execute('''
+                SELECT weight, log_date FROM weight_logs 
+                WHERE user_id = ? ORDER BY log_date DESC LIMIT 1
+            ''', (user_id,))
+            
+            latest_weight_log = cursor.fetchone()
+            
+            goal_status = {
+                'has_goal': True,
+                'goal_type': goal_type,
+                'target_weight': target_weight,
+                'target_date': target_date.isoformat() if target_date else None,
+                'goal_created_date': goal_created_date.isoformat() if goal_created_date else None,
+                'daily_calorie_target': daily_calories,
+                'current_weight': current_weight,
+                'latest_logged_weight': latest_weight_log[0] if latest_weight_log else None,
+                'latest_weight_date': latest_weight_log[1].isoformat() if latest_weight_log else None,
+                'bmr': bmr,
+                'tdee': tdee
+            }
+            
+            if goal_type in ['weight_loss', 'weight_gain'] and target_weight and current_weight:
+                if latest_weight_log:
+                    latest_weight = latest_weight_log[0]
+                    total_change_needed = target_weight - current_weight
+                    current_change = latest_weight - current_weight
+                    
+                    if total_change_needed != 0:
+                        progress_percentage = (current_change / total_change_needed) * 100
+                        goal_status['progress_percentage'] = round(progress_percentage, 1)
+                        goal_status['weight_change'] = round(current_change, 1)
+                        goal_status['weight_remaining'] = round(target_weight - latest_weight, 1)
+            
+            if target_date:
+                days_remaining = (target_date - date.today()).days
+                goal_status['days_remaining'] = days_remaining
+            
+            return jsonify({'success': True, **goal_status})
         
     except Exception as e:
-        print(f"Error getting goal status: {e}")
+        logger.error("Error getting goal status", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 # Notification routes
 @app.route('/api/notifications')
 @require_auth
 def get_notifications():
-    """Get notifications for the current user"""
+    """Get notifications for the current user, newest first; pass before=<id> for the next page"""
     try:
         user_id = session['user_id']
-        limit = int(request.args.get('limit', 10))
+        limit = max(1, min(int(request.args.get('limit', 10)), NOTIFICATION_PAGE_MAX))
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
+        before = request.args.get('before', type=int)
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        where_clause = 'WHERE user_id = ?'
-        params = [user_id]
-        
-        if unread_only:
-            where_clause += ' AND is_read = 0'
-        
-        cursor.execute(f'''
-            SELECT id, title, message, type, is_read, created_at
-            FROM notifications 
-            {where_clause}
-            ORDER BY created_at DESC
-            LIMIT ?
-        ''', params + [limit])
-        
-        notifications = []
-        for row in cursor.fetchall():
-            notifications.append({
-                'id': row[0],
-                'title': row[1],
-                'message': row[2],
-                'type': row[3],
-                'is_read': bool(row[4]),
-                'created_at': row[5]
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            filters = []
+            params = [user_id]
+            
+            if unread_only:
+                filters.append(NOTIFICATIONS_UNREAD_FILTER)
+            
+            if before is not None:
+                filters.append(NOTIFICATIONS_BEFORE_FILTER)
+                params += [before, user_id]
+            
+            cursor.execute(NOTIFICATIONS_PAGE.format(filters=' '.join(filters)), params + [limit + 1])
+            rows = cursor.fetchall()
+            
+            notifications = []
+            for row in rows[:limit]:
+                notifications.append({
+                    'id': row[0],
+                    'title': row[1],
+                    'message': row[2],
+                    'type': row[3],
+                    'is_read': bool(row[4]),
+                    'created_at': row[5]
+                })
+            
+            unread_count = count_unread_notifications(cursor, user_id)
+            
+            return jsonify({
+                'success': True,
+                'notifications': notifications,
+                'unread_count': unread_count,
+                'next_before': notifications[-1]['id'] if len(rows) > limit else None
             })
         
-        cursor.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0', (user_id,))
-        unread_count = cursor.fetchone()[0]
-        
-        return jsonify({
-            'success': True,
-            'notifications': notifications,
-            'unread_count': unread_count
-        })
-        
     except Exception as e:
-        print(f"Error getting notifications: {e}")
+        logger.error("Error getting notifications", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/notifications/<int:notification_id>/read', methods=['POST'])
 @require_auth
@@ -1081,24 +3208,27 @@ def mark_notification_read(notification_id):
     try:
         user_id = session['user_id']
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE notifications 
-            SET is_read = 1 
-            WHERE id = ? AND user_id = ?
-        ''', (notification_id, user_id))
-        
-        conn.commit()
-        
-        return jsonify({'success': True})
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE notifications 
+                SET is_read = 1 
+                WHERE id = ? AND user_id = ? AND is_read = 0
+            ''', (notification_id, user_id))
+            changed = cursor.rowcount
+            unread_count = count_unread_notifications(cursor, user_id)
+            
+            conn.commit()
+            
+            if changed:
+                notification_hub.publish(user_id, 'read', {'ids': [notification_id], 'unread_count': unread_count})
+            
+            return jsonify({'success': True, 'unread_count': unread_count})
         
     except Exception as e:
-        print(f"Error marking notification as read: {e}")
+        logger.error("Error marking notification as read", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/notifications/read_all', methods=['POST'])
 @require_auth
@@ -1107,24 +3237,62 @@ def mark_all_notifications_read():
     try:
         user_id = session['user_id']
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE notifications 
-            SET is_read = 1 
-            WHERE user_id = ? AND is_read = 0
-        ''', (user_id,))
-        
-        conn.commit()
-        
-        return jsonify({'success': True})
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE notifications 
+                SET is_read = 1 
+                WHERE user_id = ? AND is_read = 0
+            ''', (user_id,))
+            changed = cursor.rowcount
+            
+            conn.commit()
+            
+            if changed:
+                notification_hub.publish(user_id, 'read', {'all': True, 'unread_count': 0})
+            
+            return jsonify({'success': True, 'unread_count': 0})
         
     except Exception as e:
-        print(f"Error marking all notifications as read: {e}")
+        logger.error("Error marking all notifications as read", extra={'error': str(e)})
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+
+@app.route('/api/notifications/stream')
+@require_auth
+def notification_stream():
+    """Server-sent events carrying new notifications and unread-count changes for the current user"""
+    user_id = session['user_id']
+    subscription = notification_hub.subscribe(user_id)
+    if subscription is None:
+        response = jsonify({'error': 'Too many notification streams, poll instead'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event, data = subscription.events.get(timeout=NOTIFICATION_HEARTBEAT)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                if subscription.overflowed:
+                    # Dropped events cannot be replayed, so ask the client to reload the list
+                    subscription.overflowed = False
+                    yield format_sse('resync', {})
+                    continue
+                yield format_sse(event, data)
+        finally:
+            notification_hub.unsubscribe(subscription)
+    
+    response = Response(events(), mimetype='text/event-stream')
+    # Also covers a client that disconnects before the generator starts
+    response.call_on_close(lambda: notification_hub.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # Meal logging routes
 @app.route('/get_meals_for_date')
@@ -1142,38 +3310,32 @@ def get_meals_for_date():
             return jsonify({'error': 'Invalid date format'})
         
         user_id = session['user_id']
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT food_id, food_name, meal_type, quantity, calories, protein, carbohydrates, fat, logged_at
-            FROM meal_log 
-            WHERE user_id = ? AND date_eaten = ? 
-            ORDER BY logged_at DESC
-        ''', (user_id, selected_date))
-        
-        meals = []
-        for row in cursor.fetchall():
-            food_id, food_name, meal_type, quantity, calories, protein, carbs, fat, logged_at = row
-            meals.append({
-                'food_id': food_id,
-                'food_name': food_name,
-                'meal_type': meal_type,
-                'quantity': quantity,
-                'calories': calories,
-                'protein': protein,
-                'carbohydrates': carbs,
-                'fat': fat,
-                'logged_at': logged_at
-            })
-        
-        return jsonify({'success': True, 'meals': meals, 'date': date_str})
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(MEAL_LOG_FOR_DATE, (user_id, selected_date))
+            
+            meals = []
+            for row in cursor.fetchall():
+                meal_id, food_id, food_name, meal_type, quantity, calories, protein, carbs, fat, logged_at = row
+                meals.append({
+                    'id': meal_id,
+                    'food_id': food_id,
+                    'food_name': food_name,
+                    'meal_type': meal_type,
+                    'quantity': quantity,
+                    'calories': calories,
+                    'protein': protein,
+                    'carbohydrates': carbs,
+                    'fat': fat,
+                    'logged_at': logged_at
+                })
+            
+            return jsonify({'success': True, 'meals': meals, 'date': date_str})
         
     except Exception as e:
-        print(f"Error getting meals for date {date_str}: {e}")
+        meal_logger.error("Error getting meals for date", extra={'date': date_str, 'error': str(e)})
         return jsonify({'error': str(e)})
-    finally:
-        conn.close()
 
 @app.route('/log_meal', methods=['POST'])
 @require_auth
@@ -1208,15 +3370,92 @@ def log_meal_route():
         if food_data.get('source') == 'api':
             save_food_to_mdm(food_data)
         
-        success = log_meal(food_data, meal_type, quantity, date_eaten, user_id)
+        meal_id = log_meal(food_data, meal_type, quantity, date_eaten, user_id)
         
-        if success:
-            return jsonify({'success': True, 'message': 'Meal logged successfully'})
+        if meal_id:
+            return jsonify({'success': True, 'message': 'Meal logged successfully', 'meal_id': meal_id})
         else:
             return jsonify({'error': 'Failed to log meal to database'}), 500
             
     except Exception as e:
-        print(f"Log meal route error: {str(e)}")
+        meal_logger.error("Log meal route error", extra={'error': str(e)})
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/api/log_meals', methods=['POST'])
+@require_auth
+def log_meals_route():
+    """Log many meal entries for the current user in one transaction"""
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        entries = data.get('entries')
+        
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'error': 'entries must be a non-empty list'}), 400
+        if len(entries) > MEAL_BATCH_MAX_ENTRIES:
+            return jsonify({'error': f'At most {MEAL_BATCH_MAX_ENTRIES} entries per batch'}), 400
+        
+        results = []
+        rows = []
+        api_foods = []
+        for index, entry in enumerate(entries):
+            entry = entry if isinstance(entry, dict) else {}
+            food_data = entry.get('food')
+            meal_type = entry.get('meal_type')
+            quantity = entry.get('quantity')
+            
+            error = None
+            if not isinstance(food_data, dict) or not food_data:
+                error = 'Missing food data'
+            elif not meal_type:
+                error = 'Missing meal type'
+            else:
+                try:
+                    if float(quantity) <= 0:
+                        error = 'Quantity must be greater than 0'
+                except (ValueError, TypeError):
+                    error = 'Invalid quantity format'
+            
+            if error:
+                results.append({'index': index, 'success': False, 'error': error})
+                continue
+            
+            rows.append(build_meal_log_row(food_data, meal_type, float(quantity), entry.get('date_eaten'), user_id))
+            results.append({'index': index, 'success': True})
+            if food_data.get('source') == 'api':
+                api_foods.append(food_data)
+        
+        if rows:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                
+                try:
+                    if api_foods:
+                        upsert_foods(cursor, api_foods)
+                    cursor.executemany(MEAL_LOG_INSERT, rows)
+                    
+                    # The write lock is held since the inserts, so their ids are the last len(rows)
+                    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'meal_log'")
+                    first_id = cursor.fetchone()[0] - len(rows) + 1
+                    conn.commit()
+                    
+                except Exception:
+                    conn.rollback()
+                    raise
+            
+            logged = [result for result in results if result['success']]
+            for offset, result in enumerate(logged):
+                result['meal_id'] = first_id + offset
+        
+        return jsonify({
+            'success': True,
+            'logged': len(rows),
+            'failed': len(results) - len(rows),
+            'results': results
+        })
+        
+    except Exception as e:
+        meal_logger.error("Batch log meal error", extra={'error': str(e)})
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/delete_meal', methods=['POST'])
@@ -1231,25 +3470,262 @@ def delete_meal_route():
         quantity = data.get('quantity')
         date_eaten = data.get('date_eaten', datetime.now().date().isoformat())
         
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(MEAL_LOG_DELETE_ONE, (user_id, food_id, meal_type, float(quantity), date_eaten))
+            
+            deleted_rows = cursor.rowcount
+            conn.commit()
+            
+            return jsonify({'success': True, 'deleted_rows': deleted_rows})
         
-        cursor.execute('''
-            DELETE FROM meal_log 
-            WHERE user_id = ? AND food_id = ? AND meal_type = ? AND quantity = ? AND date_eaten = ?
-            LIMIT 1
-        ''', (user_id, food_id, meal_type, float(quantity), date_eaten))
+    except Exception as e:
+        meal_logger.error("Error deleting meal", extra={'error': str(e)})
+        return jsonify({'error': str(e)})
+
+def nutrition_totals(row):
+    """Round a (calories, protein, carbohydrates, fat, item_count) aggregate for the API"""
+    calories, protein, carbs, fat, item_count = row
+    return {
+        'calories': round(calories or 0, 1),
+        'protein': round(protein or 0, 1),
+        'carbohydrates': round(carbs or 0, 1),
+        'fat': round(fat or 0, 1),
+        'item_count': item_count or 0
+    }
+
+@app.route('/api/daily_nutrition')
+@require_auth
+def get_daily_nutrition():
+    """Get nutrition totals and per-meal breakdown for a day, or start..end, from the rollup table"""
+    try:
+        ranged = 'start' in request.args or 'end' in request.args
+        try:
+            if ranged:
+                start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+                end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+            else:
+                date_str = request.args.get('date', date.today().isoformat())
+                start_date = end_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            if ranged:
+                return jsonify({'error': 'start and end dates (YYYY-MM-DD) are required'}), 400
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        days = (end_date - start_date).days + 1
+        if days < 1:
+            return jsonify({'error': 'end must not be before start'}), 400
+        if days > MEAL_RANGE_MAX_DAYS:
+            return jsonify({'error': f'Range is limited to {MEAL_RANGE_MAX_DAYS} days'}), 400
+        
+        user_id = session['user_id']
+        
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            # One primary-key range seek; a single day is the range date..date
+            cursor.execute(DAILY_NUTRITION_RANGE, (user_id, start_date, end_date))
+            
+            by_meal_type = {}
+            totals = [0.0, 0.0, 0.0, 0.0, 0]
+            for row in cursor.fetchall():
+                by_meal_type[row[0]] = nutrition_totals(row[1:])
+                totals = [total + value for total, value in zip(totals, row[1:])]
+            
+            result = {
+                'success': True,
+                'totals': nutrition_totals(totals),
+                'meals': by_meal_type
+            }
+            if ranged:
+                result.update(start=start_date.isoformat(), end=end_date.isoformat())
+            else:
+                result['date'] = date_str
+            return jsonify(result)
         
-        deleted_rows = cursor.rowcount
+    except Exception as e:
+        meal_logger.error("Error getting daily nutrition", extra={'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+
+def nutrition_period_key(day, granularity):
+    """Bucket a date into its day, ISO week (Monday) or month"""
+    if granularity == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if granularity == 'month':
+        return day.strftime('%Y-%m')
+    return day.isoformat()
+
+@app.route('/api/meals_range')
+@require_auth
+def get_meals_range():
+    """Get meals and day/week/month nutrition totals for a date range in one query"""
+    try:
+        start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'start and end dates (YYYY-MM-DD) are required'}), 400
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+    
+    days = (end_date - start_date).days + 1
+    if days < 1:
+        return jsonify({'error': 'end must not be before start'}), 400
+    if days > MEAL_RANGE_MAX_DAYS:
+        return jsonify({'error': f'Range is limited to {MEAL_RANGE_MAX_DAYS} days'}), 400
+    
+    user_id = session['user_id']
+    
+    def generate():
+        periods = OrderedDict()
+        totals = [0.0, 0.0, 0.0, 0.0, 0]
+        
+        yield '{"success": true, "start": "%s", "end": "%s", "granularity": "%s", "meals": [' % (
+            start_date.isoformat(), end_date.isoformat(), granularity
+        )
+        
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(MEAL_LOG_RANGE, (user_id, start_date, end_date))
+            
+            separator = ''
+            for row in cursor:
+                meal_id, date_eaten, food_id, food_name, meal_type, quantity, calories, protein, carbs, fat, logged_at = row
+                values = (calories or 0, protein or 0, carbs or 0, fat or 0, 1)
+                
+                period = periods.setdefault(
+                    nutrition_period_key(date_eaten, granularity),
+                    {'totals': [0.0, 0.0, 0.0, 0.0, 0], 'meals': {}}
+                )
+                meal_totals = period['meals'].setdefault(meal_type, [0.0, 0.0, 0.0, 0.0, 0])
+                for acc in (totals, period['totals'], meal_totals):
+                    for i, value in enumerate(values):
+                        acc[i] += value
+                
+                yield separator + app.json.dumps({
+                    'id': meal_id,
+                    'date_eaten': date_eaten.isoformat(),
+                    'food_id': food_id,
+                    'food_name': food_name,
+                    'meal_type': meal_type,
+                    'quantity': quantity,
+                    'calories': calories,
+                    'protein': protein,
+                    'carbohydrates': carbs,
+                    'fat': fat,
+                    'logged_at': logged_at
+                })
+                separator = ', '
+        
+        yield '], "periods": ' + app.json.dumps([
+            {
+                'period': key,
+                'totals': nutrition_totals(period['totals']),
+                'meals': {meal_type: nutrition_totals(values) for meal_type, values in period['meals'].items()}
+            }
+            for key, period in periods.items()
+        ])
+        yield ', "totals": ' + app.json.dumps(nutrition_totals(totals)) + '}'
+    
+    try:
+        if days > MEAL_RANGE_STREAM_DAYS:
+            return Response(stream_with_context(generate()), mimetype='application/json')
+        return Response(''.join(generate()), mimetype='application/json')
+        
+    except Exception as e:
+        meal_logger.error("Error getting meals for range", extra={'start_date': start_date, 'end_date': end_date, 'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('rebuild-nutrition')
+def rebuild_nutrition_command():
+    """Rebuild the daily_nutrition rollup from meal_log"""
+    with get_db() as conn:
+        rows = rebuild_daily_nutrition(conn.cursor())
         conn.commit()
+    print(f"✅ Rebuilt daily_nutrition: {rows} rows")
+
+@app.route('/api/meals/delete', methods=['POST'])
+@require_auth
+def delete_meals_route():
+    """Delete one or many of the current user's meal entries by id in a single transaction"""
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        ids = data.get('ids')
+        if ids is None and data.get('id') is not None:
+            ids = [data.get('id')]
+        
+        try:
+            ids = sorted({int(meal_id) for meal_id in ids or []})
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Meal ids must be integers'}), 400
+        if not ids:
+            return jsonify({'error': 'No meal ids provided'}), 400
+        
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            deleted_rows = 0
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    DELETE FROM meal_log WHERE user_id = ? AND id IN ({placeholders})
+                ''', [user_id] + chunk)
+                deleted_rows += cursor.rowcount
+            
+            conn.commit()
+            
+            return jsonify({'success': True, 'deleted_rows': deleted_rows})
+        
+    except Exception as e:
+        meal_logger.error("Error deleting meals", extra={'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/meals/copy', methods=['POST'])
+@require_auth
+def copy_meals_route():
+    """Copy the current user's meals from a source date (optionally one meal type) to a target date"""
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        meal_type = data.get('meal_type')
+        target_meal_type = data.get('target_meal_type') or meal_type
+        
+        try:
+            source_date = datetime.strptime(data.get('source_date', ''), '%Y-%m-%d').date()
+            target_date = datetime.strptime(data.get('target_date', ''), '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            return jsonify({'error': 'source_date and target_date must be YYYY-MM-DD'}), 400
         
-        return jsonify({'success': True, 'deleted_rows': deleted_rows})
+        if source_date == target_date and target_meal_type == meal_type:
+            return jsonify({'error': 'Source and target are the same'}), 400
         
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            # The meal_log triggers keep daily_nutrition in step within this transaction
+            cursor.execute('''
+                INSERT INTO meal_log
+                (user_id, food_id, food_name, meal_type, quantity, calories, protein, carbohydrates, fat, date_eaten)
+                SELECT user_id, food_id, food_name, COALESCE(?, meal_type), quantity,
+                       calories, protein, carbohydrates, fat, ?
+                FROM meal_log
+                WHERE user_id = ? AND date_eaten = ? AND (? IS NULL OR meal_type = ?)
+                ORDER BY logged_at, id
+            ''', (target_meal_type, target_date, user_id, source_date, meal_type, meal_type))
+            copied_rows = cursor.rowcount
+            
+            conn.commit()
+            
+            return jsonify({'success': True, 'copied_rows': copied_rows})
+    
     except Exception as e:
-        print(f"❌ Error deleting meal: {e}")
-        return jsonify({'error': str(e)})
-    finally:
-        conn.close()
+        meal_logger.error("Error copying meals", extra={'error': str(e)})
+        return jsonify({'error': str(e)}), 500
 
 # Food search routes
 @app.route('/search')
@@ -1262,74 +3738,57 @@ def search():
         return jsonify({'error': 'No query provided'})
     
     try:
+        strategy = SEARCH_STRATEGY
+        deadline = time.monotonic() + (SEARCH_PARALLEL_DEADLINE if strategy == 'parallel' else UPSTREAM_DEADLINE)
+        upstream_call = None
+        
+        if strategy == 'parallel':
+            upstream_call = UpstreamSearchCall(query, page, deadline)
+        
         local_results = search_local_mdm(query)
-        print(f"Found {len(local_results)} local results for '{query}'")
+        search_logger.debug("Local search results", extra={'query': query, 'results': len(local_results)})
         
         api_results = []
         
-        try:
-            session_req = requests.Session()
-            
-            main_url = 'https://kaloriabazis.hu/'
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'hu-HU,hu;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
-            
-            main_response = session_req.get(main_url, headers=headers, timeout=10)
-            
-            api_url = 'https://kaloriabazis.hu/getfood.php'
-            api_params = {
-                'fav': 'false',
-                'q': query,
-                'p': page
-            }
-            api_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'application/json, text/javascript, */*; q=0.01',
-                'Accept-Language': 'hu-HU,hu;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Referer': 'https://kaloriabazis.hu/',
-                'X-Requested-With': 'XMLHttpRequest',
-            }
-            
-            response = session_req.get(api_url, params=api_params, headers=api_headers, timeout=10)
-            
-            if response.status_code == 200:
-                text = response.text
+        if strategy == 'local_first' and len(local_results) >= LOCAL_FIRST_MIN_RESULTS:
+            search_path = 'local'
+        else:
+            search_path = 'local+upstream'
+            try:
+                if upstream_call is None:
+                    upstream_call = UpstreamSearchCall(query, page, deadline)
+                api_results = upstream_call.result()
                 
-                if 'die_with_text' not in text and len(text) >= 50:
-                    data = json.loads(text)
-                    
-                    if 'results2' in data and isinstance(data['results2'], list):
-                        api_results = data['results2']
-                    elif 'results1' in data and isinstance(data['results1'], list):
-                        api_results = data['results1']
-                    
-                    for result in api_results:
-                        result['source'] = 'api'
-                    
-                    local_food_ids = {r.get('food_id') for r in local_results}
-                    api_results = [r for r in api_results if r.get('food_id') not in local_food_ids and r.get('ID') not in local_food_ids]
-                    
-        except Exception as api_error:
-            print(f"API search failed: {api_error}")
+                for result in api_results:
+                    result['source'] = 'api'
+                
+                local_food_ids = {r.get('food_id') for r in local_results}
+                api_results = [r for r in api_results if r.get('food_id') not in local_food_ids and r.get('ID') not in local_food_ids]
+                
+            except UpstreamUnavailableError:
+                search_path = 'local+circuit_open'
+            except FutureTimeoutError:
+                search_path = 'local+upstream_timeout'
+                upstream_logger.warning("API search missed its deadline", extra={'query': query})
+            except Exception as api_error:
+                upstream_logger.warning("API search failed", extra={'error': str(api_error)})
         
         all_results = []
         
-        if page == 1:
-            all_results.extend(local_results[:8])
-        
-        remaining_slots = 8 - len(all_results)
-        if remaining_slots > 0:
-            all_results.extend(api_results[:remaining_slots])
+        if search_path == 'local':
+            # Local hits alone fill the page, so they are paged like API results
+            all_results.extend(local_results[(page - 1) * 8:page * 8])
+            total_local = len(local_results)
+        else:
+            if page == 1:
+                all_results.extend(local_results[:8])
+            
+            remaining_slots = 8 - len(all_results)
+            if remaining_slots > 0:
+                all_results.extend(api_results[:remaining_slots])
+            
+            total_local = len(local_results) if page == 1 else 0
         
-        total_local = len(local_results) if page == 1 else 0
         total_api = len(api_results)
         combined_total = total_local + total_api
         
@@ -1338,7 +3797,9 @@ def search():
             'total_results': combined_total,
             'total_pages': max(1, (combined_total + 7) // 8),
             'local_count': len([r for r in all_results if r.get('source') == 'local']),
-            'api_count': len([r for r in all_results if r.get('source') == 'api'])
+            'api_count': len([r for r in all_results if r.get('source') == 'api']),
+            'strategy': strategy,
+            'search_path': search_path
         }
         
         return jsonify({
@@ -1348,7 +3809,7 @@ def search():
         })
         
     except Exception as e:
-        print(f"Search error: {e}")
+        search_logger.error("Search error", extra={'query': query, 'error': str(e)})
         return jsonify({'error': str(e)})
 
 @app.route('/portions')
@@ -1368,6 +3829,56 @@ def get_portions():
     return jsonify({'food_id': food_id, 'portions': default_portions, 'source': 'default'})
 
 # Debug routes
+def collect_diagnostics():
+    """Stats from the caches, upstream guards, background writers and pools"""
+    return {
+        'search_cache': search_cache.stats(),
+        'upstream_breaker': upstream_breaker.stats(),
+        'upstream_hedging': upstream_hedging_stats(),
+        'upstream_single_flight': upstream_flights.stats(),
+        'mdm_write_behind': food_write_behind.stats(),
+        'user_profile_cache': user_profile_cache.stats(),
+        'connection_pool': db_pool.stats(),
+        'notification_streams': notification_hub.stats(),
+        'announcement_fanout': announcement_fanout.stats(),
+        'logging': {
+            'level': logging.getLevelName(logger.getEffectiveLevel()),
+            'queued': log_listener.queue.qsize(),
+            'dropped': logger.handlers[0].dropped
+        }
+    }
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of request, SQLite, upstream and cache metrics"""
+    lines = metrics.render()
+    render_gauges('foodapp', collect_diagnostics(), lines)
+    lines.append('# TYPE foodapp_info untyped')
+    lines.append(f"foodapp_info{format_labels((('version', __version__), ('search_strategy', SEARCH_STRATEGY)))} 1")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/health')
+def health():
+    """Liveness/readiness check: 503 if SQLite is unreachable, degraded while the upstream breaker is open"""
+    checks = {}
+    healthy = True
+    try:
+        with get_db() as conn:
+            conn.execute('SELECT 1').fetchone()
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = str(e)
+        healthy = False
+    
+    checks['upstream'] = upstream_breaker.stats()['state']
+    status = 'ok' if checks['upstream'] == 'closed' else 'degraded'
+    
+    return jsonify({
+        'status': status if healthy else 'unhealthy',
+        'version': __version__,
+        'checks': checks
+    }), 200 if healthy else 503
+
 @app.route('/debug')
 def debug():
     """Debug endpoint for testing"""
@@ -1375,43 +3886,45 @@ def debug():
     return jsonify({
         'query': query,
         'status': 'debug endpoint working',
-        'message': 'API connection test'
+        'message': 'API connection test',
+        **collect_diagnostics()
     })
 
 @app.route('/test_db')
 def test_database():
     """Test database connectivity"""
     try:
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        table_info = {}
-        for (table_name,) in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            count = cursor.fetchone()[0]
-            table_info[table_name] = count
-        
-        return jsonify({
-            'database_path': DB_PATH,
-            'database_exists': os.path.exists(DB_PATH),
-            'tables': table_info
-        })
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            tables = cursor.fetchall()
+            
+            table_info = {}
+            for (table_name,) in tables:
+                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                count = cursor.fetchone()[0]
+                table_info[table_name] = count
+            
+            return jsonify({
+                'database_path': DB_PATH,
+                'database_exists': os.path.exists(DB_PATH),
+                'journal_mode': conn.execute('PRAGMA journal_mode').fetchone()[0],
+                'connection_pool': db_pool.stats(),
+                'tables': table_info
+            })
         
     except Exception as e:
         return jsonify({'error': str(e)})
-    finally:
-        conn.close()
 
 @app.route('/test')
 def test():
     """Simple test endpoint"""
     return {'status': 'ok', 'message': 'Flask is working!'}
 
-# Initialize database on startup
+# Initialize database on startup, then deliver any pending announcements in the background
 init_database()
+announcement_fanout.start()
 
 if __name__ == '__main__':
     print("🚀 Starting Complete Enhanced Food Search App...")
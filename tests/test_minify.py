@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    # Importing the app initializes food_app.db in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('db'))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_minified_app_js_parses(app_module, tmp_path):
+    with open(os.path.join(app_module.ASSET_DIR, 'app.js'), encoding='utf-8') as f:
+        source = f.read()
+    minified = tmp_path / 'app.min.js'
+    minified.write_text(app_module.minify_js(source), encoding='utf-8')
+
+    result = subprocess.run(['node', '--check', str(minified)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert len(minified.read_text(encoding='utf-8')) < len(source)
+
+
+@pytest.mark.parametrize('source, expected', [
+    ('var a = b / c / d;', 'var a=b / c / d;\n'),
+    ('var h = (w) / 2;', 'var h=(w)/ 2;\n'),
+    ('var r = /ab+c/.test(s);', 'var r=/ab+c/.test(s);\n'),
+    ('function f() {\n    return /x\\/y/g;\n}', 'function f(){return /x\\/y/g;}\n'),
+    ('q = s.replace(/\'/g, "");', 'q=s.replace(/\'/g,"");\n'),
+    ('ok = /[/]/.test(s);', 'ok=/[/]/.test(s);\n'),
+    ('let t = `a ${b / 2} c`;', 'let t=`a ${b / 2} c`;\n'),
+])
+def test_minify_js_regex_and_division(app_module, source, expected):
+    assert app_module.minify_js(source) == expected
+
+
+@pytest.mark.parametrize('source, expected', [
+    ("// don't\nvar a = 1; /* it's */ var b = 2;", 'var a=1;var b=2;\n'),
+    ("var s = '/* not a comment */'; // it's", "var s='/* not a comment */';\n"),
+])
+def test_minify_js_comments_with_quotes(app_module, source, expected):
+    assert app_module.minify_js(source) == expected
+
+
+@pytest.mark.parametrize('source, expected', [
+    ("/* don't */ a{b:c} /* it's */ d{e:f}", 'a{b:c}d{e:f}'),
+    ('a::before { content: "/* keep */ it\'s" }', 'a::before{content:"/* keep */ it\'s"}'),
+    ('a { b: c } /* unterminated', 'a{b:c}'),
+])
+def test_minify_css_comments_and_strings(app_module, source, expected):
+    assert app_module.minify_css(source) == expected
+
+
+def test_minify_css_keeps_calc_spacing(app_module):
+    source = '.a {\n    width: calc(100% - 2 * var(--gap));\n    margin: calc(1px + 2px);\n}'
+    assert app_module.minify_css(source) == '.a{width:calc(100% - 2 * var(--gap));margin:calc(1px + 2px)}'